@@ -0,0 +1,85 @@
+import sys
+import random
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "hw2"))
+
+from indexes import MinHashIndex
+
+VOCABULARY = [f"w{i}" for i in range(5000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]   # Zipf
+PAIRS = 40                  # edited copies per note length
+UNRELATED = 2000
+
+
+def text(rng: random.Random, size: int) -> list[str]:
+    return rng.choices(VOCABULARY, WEIGHTS, k=size)
+
+
+def edit(rng: random.Random, words: list[str], rate: float) -> list[str]:
+    # replaces, inserts or deletes about `rate` of the words (at least one)
+    words = list(words)
+    for _ in range(max(1, round(len(words) * rate))):
+        i = rng.randrange(len(words))
+        change = rng.randrange(3)
+        if change == 0:
+            words[i] = rng.choice(VOCABULARY)
+        elif change == 1:
+            words.insert(i, rng.choice(VOCABULARY))
+        else:
+            del words[i]
+    return words
+
+
+def recall(rng: random.Random, size: int, change) -> tuple:
+    # found edited copies and the other notes reported as near-duplicates
+    index = MinHashIndex()
+    for key in range(UNRELATED):
+        index.add(("other", key), text(rng, size))
+    for key in range(PAIRS):
+        words = text(rng, size)
+        index.add(("note", key), words)
+        index.add(("copy", key), change(words))
+    found = sum(
+        ("copy", key) in {x for _, x in index.search(("note", key))}
+        for key in range(PAIRS)
+    )
+    wrong = sum(
+        other[0] == "other"
+        for key in range(PAIRS) for _, other in index.search(("note", key))
+    )
+    return found, wrong
+
+
+def main(count: int):
+    rng = random.Random(1)
+    cases = [
+        ("append a word", 18, lambda words: words + ["extra"]),
+        ("2% edits", 18, lambda words: edit(rng, words, 0.02)),
+        ("2% edits", 200, lambda words: edit(rng, words, 0.02)),
+        ("2% edits", 1000, lambda words: edit(rng, words, 0.02)),
+        ("5% edits", 200, lambda words: edit(rng, words, 0.05)),
+        ("10% edits", 200, lambda words: edit(rng, words, 0.1)),
+        ("20% edits", 200, lambda words: edit(rng, words, 0.2)),
+    ]
+    for label, size, change in cases:
+        found, wrong = recall(rng, size, change)
+        print(f"{label:<14} {size:>5} words: {found}/{PAIRS} found, "
+              f"{wrong} unrelated notes reported")
+    notes = [text(rng, 100) for _ in range(count)]
+    for i in range(0, count, 10):                   # 10% edited copies
+        notes[i] = edit(rng, notes[i - 1], 0.02)
+    index = MinHashIndex()
+    start = perf_counter()
+    for key, words in enumerate(notes):
+        index.add(key, words)
+    built = perf_counter() - start
+    start = perf_counter()
+    clusters = index.clusters()
+    print(f"{count} notes of 100 words: built in {built:.1f} s, "
+          f"{len(clusters)} clusters in {perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
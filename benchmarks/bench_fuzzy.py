@@ -0,0 +1,66 @@
+import sys
+import random
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "hw2"))
+
+from indexes import BKTree, levenshtein
+
+SYLLABLES = ["an", "bo", "ca", "de", "el", "fi", "ga", "ho", "is", "ju",
+             "ka", "li", "mo", "na", "ol", "pe", "ra", "si", "ta", "vi"]
+QUERIES = 50
+
+
+def synthetic_name(rng: random.Random) -> str:
+    first = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 3)))
+    last = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+    return f"{first.title()} {last.title()}"
+
+
+def typo(rng: random.Random, name: str, edits: int) -> str:
+    for _ in range(edits):
+        i = rng.randrange(len(name))
+        name = rng.choice([
+            name[:i] + name[i + 1:],                            # deletion
+            name[:i] + rng.choice("aeiou") + name[i:],          # insertion
+            name[:i] + rng.choice("aeiou") + name[i + 1:],      # change
+        ])
+    return name
+
+
+def main(count: int):
+    rng = random.Random(1)
+    calls = 0
+
+    def distance(a: str, b: str) -> int:
+        nonlocal calls
+        calls += 1
+        return levenshtein(a, b)
+
+    names = set()
+    while len(names) < count:
+        names.add(synthetic_name(rng))
+    tree = BKTree(distance)
+    start = perf_counter()
+    for name in names:
+        tree.add(name, name.lower())
+    print(f"{len(names)} names, {tree.size} nodes, "
+          f"built in {perf_counter() - start:.1f} s")
+    sample = rng.sample(sorted(names), QUERIES)
+    for k in (1, 2):
+        queries = [typo(rng, name, k).lower() for name in sample]
+        calls = 0
+        start = perf_counter()
+        found = sum(
+            any(key == name for _, key in tree.search(query, k))
+            for query, name in zip(queries, sample)
+        )
+        elapsed = (perf_counter() - start) / QUERIES
+        print(f"k={k}: {elapsed * 1000:.1f} ms/query, "
+              f"{calls / QUERIES / tree.size:.2%} of the nodes visited, "
+              f"{found}/{QUERIES} originals found")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
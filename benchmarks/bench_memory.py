@@ -0,0 +1,95 @@
+import gc
+import sys
+import random
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "hw2"))
+
+from addrbook import Record
+
+SIZES = (100_000, 1_000_000)
+
+
+class PlainField:
+    # Record and the Field classes as they were before __slots__, with
+    # their attributes in a per-instance __dict__
+    def __init__(self, value: str):
+        self.value = value
+
+
+class PlainName(PlainField):
+    pass
+
+
+class PlainPhone(PlainField):
+    pass
+
+
+class PlainEmail(PlainField):
+    pass
+
+
+class PlainBirthday(PlainField):
+    pass
+
+
+class PlainRecord:
+    def __init__(self, name, birthday, email, phone: list):
+        self.name = name
+        self.birthday = birthday
+        self.email = email
+        self.phone = phone
+        self.phone_values = {x.value for x in phone}
+
+
+def contacts(count: int):
+    # (name, birthday, email, phones); some optional fields stay empty
+    rng = random.Random(1)
+    for i in range(count):
+        yield (
+            f"Contact {i:07}",
+            f"19{rng.randrange(100):02}-0{rng.randint(1, 9)}-1{i % 10}"
+            if i % 2 else None,
+            f"contact{i}@example.com" if i % 3 else None,
+            [f"380{rng.randrange(10 ** 9):09}"
+             for _ in range(rng.randint(1, 2))],
+        )
+
+
+def slotted(name, birthday, email, phones) -> Record:
+    return Record.trusted(name, birthday, email, phones)
+
+
+def plain(name, birthday, email, phones) -> PlainRecord:
+    return PlainRecord(
+        PlainName(name),
+        PlainBirthday(birthday) if birthday else None,
+        PlainEmail(email) if email else None,
+        [PlainPhone(x) for x in phones],
+    )
+
+
+def measure(count: int, build) -> float:
+    # MiB held by a {name: record} dict of `count` records
+    rows = list(contacts(count))
+    gc.collect()
+    tracemalloc.start()
+    data = {row[0]: build(*row) for row in rows}
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del data
+    return size / 2 ** 20
+
+
+def main(sizes: list[int]):
+    for count in sizes:
+        before = measure(count, plain)
+        after = measure(count, slotted)
+        print(f"{count:>9} contacts: __dict__ {before:8.1f} MiB  "
+              f"__slots__ {after:8.1f} MiB  "
+              f"({after / before:.0%})")
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or SIZES)
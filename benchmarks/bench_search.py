@@ -0,0 +1,62 @@
+import sys
+import random
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "hw2"))
+
+from addrbook import AddressBook, Record
+
+SYLLABLES = ["an", "bo", "ca", "de", "el", "fi", "ga", "ho", "is", "ju",
+             "ka", "li", "mo", "na", "ol", "pe", "ra", "si", "ta", "vi"]
+REPEAT = 20
+
+
+def synthetic_book(count: int) -> AddressBook:
+    rng = random.Random(1)
+    book = AddressBook(Path(__file__).with_name("missing.json"))
+    while len(book.data) < count:
+        first = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 3)))
+        last = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        name = f"{first.title()} {last.title()}"
+        phone = f"380{rng.randrange(10 ** 9):09}"
+        book.data[name] = Record.trusted(name, None, None, [phone])
+    book.indexes_scan()
+    return book
+
+
+def measure(book: AddressBook, query: str, scan: bool) -> tuple:
+    start = perf_counter()
+    for _ in range(REPEAT):
+        if scan:
+            found = [name for name, record in book.data.items()
+                     if query in record]
+        else:
+            found = list(book.iter_search(query))
+    return (perf_counter() - start) / REPEAT * 1000, len(found)
+
+
+def main(count: int):
+    book = synthetic_book(count)
+    start = perf_counter()
+    book.ngrams_scan()
+    print(f"{len(book)} contacts, index built in "
+          f"{perf_counter() - start:.1f} s")
+    sample = random.Random(2).choice(sorted(book.data))
+    phone = book.data[sample].phone[0].value
+    queries = {
+        "full name": sample,
+        "last name": sample.split()[1],
+        "phone digits": phone[4:11],
+        "3 letters": "ali",
+        "2 letters": "an",
+    }
+    for label, query in queries.items():
+        indexed, found = measure(book, query, scan=False)
+        scanned, _ = measure(book, query, scan=True)
+        print(f"{label:<14} {query!r:<20} {found:>8} found  "
+              f"index {indexed:8.2f} ms  scan {scanned:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
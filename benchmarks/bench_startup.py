@@ -0,0 +1,84 @@
+import sys
+import random
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+HW2 = Path(__file__).resolve().parents[1] / "hw2"
+sys.path.insert(0, str(HW2))
+
+from addrbook import AddressBook, Record
+from notebook import NoteBook
+
+REPEAT = 3
+WORDS = ["alpha", "beta", "gamma", "delta", "omega", "note", "call", "buy"]
+TAGS = [f"#t{i}" for i in range(50)]
+# a new interpreter that imports the app and loads one book
+STARTUP = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from addrbook import AddressBook
+from notebook import NoteBook
+{book}(sys.argv[2])
+"""
+
+
+def write_books(folder: Path, contacts: int, notes: int):
+    rng = random.Random(1)
+    book = AddressBook(folder / "ab.json")
+    for i in range(contacts):
+        name = f"Contact {i:07}"
+        book.data[name] = Record.trusted(
+            name, f"19{rng.randrange(100):02}-0{rng.randint(1, 9)}-15",
+            f"contact{i}@example.com", [f"380{rng.randrange(10 ** 9):09}"]
+        )
+    book.save_changes = True
+    book.write_to_file()
+    notebook = NoteBook(folder / "nb.json")
+    for i in range(notes):
+        notebook.data[i] = {
+            "text": " ".join(rng.choices(WORDS, k=30)),
+            "created": f"2024-0{rng.randint(1, 9)}-1{i % 10}",
+            "tags": rng.sample(TAGS, 2),
+        }
+    notebook.tags_scan()
+    notebook.save_changes = True
+    notebook.write_to_file()
+
+
+def cold_start(book: str, path: Path) -> float:
+    # best wall time of a new process, files in the OS cache
+    times = []
+    for _ in range(REPEAT):
+        start = perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", STARTUP.format(book=book), str(HW2),
+             str(path)],
+            check=True
+        )
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def main(contacts: int, notes: int):
+    with TemporaryDirectory() as folder:
+        folder = Path(folder)
+        write_books(folder, contacts, notes)
+        for book, count, name in (
+            ("AddressBook", contacts, "ab"), ("NoteBook", notes, "nb")
+        ):
+            path = folder / f"{name}.json"
+            snapshot = path.with_suffix(".snapshot")
+            hidden = path.with_suffix(".off")
+            snapshot.rename(hidden)                   # JSON only
+            from_json = cold_start(book, path)
+            hidden.rename(snapshot)                   # keeps its mtime
+            from_snapshot = cold_start(book, path)
+            print(f"{book:<12} {count:>8}: JSON {from_json:6.2f} s  "
+                  f"snapshot {from_snapshot:6.2f} s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 200_000)
@@ -0,0 +1,59 @@
+import sys
+import random
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "hw2"))
+
+from notebook import NoteBook
+
+TAGS = [f"#t{i}" for i in range(20)]
+QUERIES = [
+    "#t1 AND #t2 NOT #t3",
+    "#t1 #t2 #t3",
+    "(#t1 OR #t2) AND (#t4 OR #t5) AND NOT #t6",
+    "#t7 OR #t8 OR #t9",
+    "#rare AND #t1",
+]
+UPDATES = 1000
+
+
+def synthetic_notebook(count: int) -> NoteBook:
+    rng = random.Random(1)
+    notebook = NoteBook(Path(__file__).with_name("missing.json"))
+    for i in range(count):
+        notebook.data[i] = {
+            "text": "", "created": "2024-01-01",
+            "tags": rng.sample(TAGS, 3) + (["#rare"] if i % 1000 == 0 else [])
+        }
+    notebook.tags_scan()
+    notebook.max_id = count
+    return notebook
+
+
+def main(count: int):
+    notebook = synthetic_notebook(count)
+    start = perf_counter()
+    notebook.tag_bits_scan()
+    print(f"{count} notes, bitmaps built in {perf_counter() - start:.1f} s")
+    for query in QUERIES:
+        start = perf_counter()
+        found = notebook.query_notes(query)
+        print(f"{query:<44} {len(found):>7} found "
+              f"{(perf_counter() - start) * 1000:7.1f} ms")
+    note_ids = random.Random(2).sample(range(count), UPDATES)
+    start = perf_counter()
+    for note_id in note_ids:
+        notebook.add_tag(note_id, "#new")
+    for note_id in note_ids:
+        notebook.delete_tag(note_id, "#new")
+    print(f"tag update with bitmaps: "
+          f"{(perf_counter() - start) / 2 / UPDATES * 1e6:.1f} us")
+    rare = notebook.tag_bits["#rare"]
+    size = sys.getsizeof(rare) + sum(map(sys.getsizeof, rare.values()))
+    print(f"'#rare' ({len(notebook.tags['#rare'])} notes) bitmap: "
+          f"{size / 1024:.1f} KiB, {len(rare)} chunks")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -1,15 +1,28 @@
+import gc
 import json
+import zlib
+from threading import Lock, Thread
+from bisect import bisect_left, insort
+from heapq import nsmallest
+from calendar import isleap
 from collections import UserDict
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from re import search
+from indexes import NGramIndex, BKTree
+from cache import QueryCache
+from snapshot import read_snapshot, write_snapshot, is_fresh, INTS, STRINGS
 
 DATE_FORMAT = "%Y-%m-%d"
 TEXT_FORMAT = "%d %b %Y"
 MIN_YEAR = 1812
+JOURNAL_LIMIT = 1000        # journal entries that trigger compaction
+FORMAT_VERSION = 2          # ab.json written by AddressBook.write_to_file
 
 
 class Field:
+    __slots__ = ("__value",)
+
     def __init__(self, value: str = None):
         self.value = value
 
@@ -24,8 +37,17 @@ class Field:
     def __str__(self) -> str:
         return self.value
 
+    @classmethod
+    def trusted(cls, value):
+        # skips validation for the values written by the app itself
+        field = cls.__new__(cls)
+        field.__value = value
+        return field
+
 
 class Phone(Field):
+    __slots__ = ()
+
     @Field.value.setter
     def value(self, value: str):
         if len(value := str(value)) == 12 and value.isdigit():
@@ -35,6 +57,8 @@ class Phone(Field):
 
 
 class Email(Field):
+    __slots__ = ()
+
     @Field.value.setter
     def value(self, value: str):
         if search(r"^\w+([-+.']\w+)*@\w+([-.]\w+)*\.\w+([-.]\w+)*$", value):
@@ -44,10 +68,12 @@ class Email(Field):
 
 
 class Name(Field):
-    ...
+    __slots__ = ()
 
 
 class Birthday(Field):
+    __slots__ = ()
+
     @Field.value.setter
     def value(self, value: str):
         try:
@@ -60,6 +86,12 @@ class Birthday(Field):
             raise ValueError(f"'{value}' is not a valid date")
         Field.value.fset(self, birthday)
 
+    @classmethod
+    def trusted(cls, value):
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return super().trusted(value)
+
     def replace_year(self, year: int) -> datetime:
         try:
             return self.value.replace(year=year)
@@ -73,6 +105,9 @@ class Birthday(Field):
             birthday = self.replace_year(today.year + 1)
         return (birthday - today).days
 
+    def month_day(self) -> tuple[int, int]:
+        return self.value.month, self.value.day
+
     def to_date_str(self) -> str:
         return self.value.strftime(DATE_FORMAT)
 
@@ -86,35 +121,55 @@ class Birthday(Field):
         return self.days_to_birthday() <= days
 
 
+def birthday_ranges(today: datetime, days: int) -> list[tuple]:
+    # (month, day) ranges of the birthdays within `days` from `today`
+    # (same rules as Birthday.days_to_birthday, incl. Feb 29 -> Feb 28)
+    new_date = (today + timedelta(days=days)).replace(year=today.year)
+    if new_date < today:
+        new_date = new_date.replace(year=today.year + 1)
+    days = (new_date - today).days                    # standardize days
+    first = (today - timedelta(microseconds=1)).date() + timedelta(days=1)
+    last = (today + timedelta(days=days + 1, microseconds=-1)).date()
+    ranges = []
+    while first <= last:
+        end = min(last, first.replace(month=12, day=31))
+        upper = (end.month, end.day)
+        if upper == (2, 28) and not isleap(end.year):
+            upper = (2, 29)
+        ranges.append(((first.month, first.day), upper))
+        first = end + timedelta(days=1)
+    return ranges
+
+
 class Record:
+    __slots__ = ("name", "birthday", "email", "phone", "phone_values")
+
     def __init__(self, name: Name, birthday=None, email=None, phone=None):
         self.name = name
         self.birthday = birthday
         self.email = email
         self.phone: list[Phone] = []
+        self.phone_values: set[str] = set()
         self.add_phone(phone)
 
     def is_phone(self, phone: Phone) -> bool:
-        if self.phone:
-            if phone.value in set(p.value for p in self.phone):
-                return True
-        return False
+        return phone.value in self.phone_values
 
     def add_phone(self, phone) -> int:
         counter = 0
         if isinstance(phone, (list, tuple)):
             for p in phone:
-                if not self.is_phone(p):
-                    self.phone.append(p)
-                    counter += 1
+                counter += self.add_phone(p)
         elif isinstance(phone, Phone) and not self.is_phone(phone):
             self.phone.append(phone)
+            self.phone_values.add(phone.value)
             counter = 1
         return counter
 
     def delete_phone(self, phone: Phone) -> bool:
         if self.is_phone(phone):
-            self.phone.remove(phone)
+            self.phone_values.remove(phone.value)
+            self.phone = [p for p in self.phone if p.value != phone.value]
             return True
         return False
 
@@ -134,94 +189,487 @@ class Record:
             ", ".join(str(p) for p in self.phone)
         ]
 
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name.value,
+            "birthday": self.birthday.to_date_str() if self.birthday else None,
+            "email": self.email.value if self.email else None,
+            "phone": [p.value for p in self.phone],
+        }
+
+    @classmethod
+    def from_dict(cls, source: dict, trusted: bool = False):
+        birthday, email = source["birthday"], source["email"]
+        if trusted:
+            return cls.trusted(
+                source["name"], birthday, email, source["phone"]
+            )
+        return cls(
+            Name(source["name"]),
+            birthday=Birthday(birthday) if birthday else None,
+            email=Email(email) if email else None,
+            phone=[Phone(x) for x in source["phone"]],
+        )
+
+    @classmethod
+    def trusted(cls, name: str, birthday, email: str, phones: list[str]):
+        record = cls.__new__(cls)
+        record.name = Name.trusted(name)
+        record.birthday = Birthday.trusted(birthday) if birthday else None
+        record.email = Email.trusted(email) if email else None
+        record.phone = [Phone.trusted(x) for x in phones]
+        record.phone_values = set(phones)
+        return record
+
+
+class Records(dict):
+    # records of a trusted file stay plain dicts until first accessed
+    def __getitem__(self, name: str) -> Record:
+        record = super().__getitem__(name)
+        if type(record) is dict:
+            record = Record.from_dict(record, trusted=True)
+            self[name] = record
+        return record
+
+
+def record_fields(record) -> tuple:
+    # (birthday, email, phones) as stored in the file
+    if type(record) is dict:
+        return record["birthday"], record["email"], record["phone"]
+    return (
+        record.birthday.to_date_str() if record.birthday else None,
+        record.email.value if record.email else None,
+        [p.value for p in record.phone],
+    )
+
+
+class FuzzyScan(Thread):
+    # BK-tree of a copy of the names, built off the input thread; the
+    # edits made meanwhile are applied when the book takes the tree
+    def __init__(self, names: list[str]):
+        super().__init__(daemon=True)
+        self.names = names
+        self.edits: list[tuple] = []                  # (added, name)
+        self.tree = None
+
+    def run(self):
+        tree = BKTree()
+        for name in self.names:
+            tree.add(name, name.lower())
+        self.tree = tree
+
 
 class AddressBook(UserDict):
-    def __init__(self, filename="ab.json"):
+    def __init__(self, filename="ab.json", journal=False):
         super().__init__()
+        self.data = Records()
         self.file_path = Path(filename)
+        self.journal_path = self.file_path.with_suffix(".journal")
+        self.snapshot_path = self.file_path.with_suffix(".snapshot")
+        self.journal = False
+        self.cache = QueryCache()
+        self.write_lock = Lock()
         self.read_from_file()
+        self.journal = journal
+
+    def mark_changed(self):
+        self.save_changes = True
+        self.cache.invalidate()
 
     def add_record(self, record: Record):
         if record.name.value in self.data:
             raise KeyError(f"Cannot duplicate '{record.name.value}'")
         self.data[record.name.value] = record
-        self.save_changes = True
+        self.add_to_indexes(record)
+        self.mark_changed()
+        self.log("add_record", record.to_dict())
 
     def delete_record(self, name: str) -> bool:
         if name in self.data:                         # !!!
+            self.delete_from_indexes(self.data[name])
             del self.data[name]
-            self.save_changes = True
+            self.mark_changed()
+            self.log("delete_record", name)
             return True
         return False
 
     def add_phone(self, name: str, phone: Phone) -> bool:
-        if self.data[name].add_phone(phone):
-            self.save_changes = True
+        self.delete_from_ngrams(self.data[name])
+        counter = self.data[name].add_phone(phone)
+        self.add_to_ngrams(self.data[name])
+        if counter:
+            phones = phone if isinstance(phone, (list, tuple)) else [phone]
+            self.add_to_phones(name, phones)
+            self.mark_changed()
+            self.log("add_phone", name, [p.value for p in phones])
             return True
 
     def delete_phone(self, name: str, phone: Phone):
-        if self.data[name].delete_phone(phone):
-            self.save_changes = True
+        self.delete_from_ngrams(self.data[name])
+        deleted = self.data[name].delete_phone(phone)
+        self.add_to_ngrams(self.data[name])
+        if deleted:
+            self.delete_from_phones(name, [phone])
+            self.mark_changed()
+            self.log("delete_phone", name, phone.value)
 
     def update_birthday(self, name: str, birthday: Birthday):
+        if self.data[name].birthday:
+            self.delete_from_birthdays(name, self.data[name].birthday)
         self.data[name].birthday = birthday
-        self.save_changes = True
+        if birthday:
+            self.add_to_birthdays(name, birthday)
+        self.mark_changed()
+        self.log(
+            "update_birthday", name,
+            birthday.to_date_str() if birthday else None
+        )
 
     def update_email(self, name: str, email: Email):
         self.data[name].email = email
-        self.save_changes = True
+        self.mark_changed()
+        self.log("update_email", name, email.value if email else None)
+
+    def merge(self, records):
+        # bulk update: one file write instead of a journal entry per change
+        journal, self.journal = self.journal, False
+        for record in records:
+            name = record.name.value
+            if name not in self:
+                self.add_record(record)
+                continue
+            self.add_phone(name, record.phone)
+            if record.birthday and not self[name].birthday:
+                self.update_birthday(name, record.birthday)
+            if record.email and not self[name].email:
+                self.update_email(name, record.email)
+        self.journal = journal
+        self.write_to_file()
+
+    def add_to_birthdays(self, name: str, birthday: Birthday):
+        if self.birthdays is not None:
+            insort(self.birthdays, (*birthday.month_day(), name))
+
+    def delete_from_birthdays(self, name: str, birthday: Birthday):
+        if self.birthdays is not None:
+            del self.birthdays[bisect_left(
+                self.birthdays, (*birthday.month_day(), name)
+            )]
+
+    def record_grams(self, record: Record) -> set[str]:
+        grams = self.ngrams.grams(record.name.value.lower())
+        for phone in record.phone:
+            grams |= self.ngrams.grams(phone.value)
+        return grams
+
+    def add_to_phones(self, name: str, phones: list[Phone]):
+        if self.phones is None:
+            return
+        for phone in phones:
+            self.phones.setdefault(phone.value, set()).add(name)
+
+    def delete_from_phones(self, name: str, phones: list[Phone]):
+        if self.phones is None:
+            return
+        for phone in phones:
+            names = self.phones[phone.value]
+            names.discard(name)
+            if not names:
+                del self.phones[phone.value]
+
+    def add_to_ngrams(self, record: Record):
+        if self.ngrams is not None:
+            self.ngrams.add(record.name.value, self.record_grams(record))
+
+    def delete_from_ngrams(self, record: Record):
+        if self.ngrams is not None:
+            self.ngrams.delete(record.name.value, self.record_grams(record))
+
+    def ngrams_scan(self):
+        self.ngrams = NGramIndex()
+        for name in list(self.data):
+            self.add_to_ngrams(self.data[name])
+
+    def fuzzy_scan(self):
+        self.fuzzy = BKTree()
+        for name in self.data:
+            self.fuzzy.add(name, name.lower())
+
+    def start_fuzzy_scan(self):
+        if self.fuzzy is None and self.fuzzy_scanner is None:
+            self.fuzzy_scanner = FuzzyScan(list(self.data))
+            self.fuzzy_scanner.start()
+
+    def take_fuzzy(self, wait: bool):
+        # the tree of a finished background scan, brought up to date
+        scanner = self.fuzzy_scanner
+        if wait:
+            scanner.join()
+        if scanner.tree is not None:
+            self.fuzzy, self.fuzzy_scanner = scanner.tree, None
+            for added, name in scanner.edits:
+                if added:
+                    self.fuzzy.add(name, name.lower())
+                else:
+                    self.fuzzy.delete(name, name.lower())
+
+    def add_to_fuzzy(self, name: str):
+        if self.fuzzy is not None:
+            self.fuzzy.add(name, name.lower())
+        elif self.fuzzy_scanner is not None:
+            self.fuzzy_scanner.edits.append((True, name))
+
+    def delete_from_fuzzy(self, name: str):
+        if self.fuzzy is not None:
+            self.fuzzy.delete(name, name.lower())
+        elif self.fuzzy_scanner is not None:
+            self.fuzzy_scanner.edits.append((False, name))
+
+    def add_to_indexes(self, record: Record):
+        self.add_to_phones(record.name.value, record.phone)
+        self.add_to_ngrams(record)
+        self.add_to_fuzzy(record.name.value)
+        if record.birthday:
+            self.add_to_birthdays(record.name.value, record.birthday)
+
+    def delete_from_indexes(self, record: Record):
+        self.delete_from_phones(record.name.value, record.phone)
+        self.delete_from_ngrams(record)
+        self.delete_from_fuzzy(record.name.value)
+        if record.birthday:
+            self.delete_from_birthdays(record.name.value, record.birthday)
+
+    def birthdays_scan(self):
+        # works on the fields, so deferred records are not built
+        self.birthdays = []
+        for name, record in self.data.items():
+            birthday = record_fields(record)[0]
+            if birthday:                              # yyyy-mm-dd
+                self.birthdays.append(
+                    (int(birthday[5:7]), int(birthday[8:10]), name)
+                )
+        self.birthdays.sort()
+
+    def phones_scan(self):
+        self.phones = {}
+        for name, record in self.data.items():
+            for phone in record_fields(record)[2]:
+                self.phones.setdefault(phone, set()).add(name)
+
+    def indexes_scan(self):
+        self.birthdays = None                         # built by first search
+        self.phones = None
+        self.ngrams = None
+        self.fuzzy = None
+        self.fuzzy_scanner = None                     # a running FuzzyScan
 
     def search_birthday(self, days: int) -> list[str]:
-        today = datetime.today()
-        new_date = (today + timedelta(days=days)).replace(year=today.year)
-        if new_date < today:
-            new_date = new_date.replace(year=today.year + 1)
-        days = (new_date - today).days                # standardize days
-        return sorted(
-            name for name, record in self.data.items()
-            if record.birthday and days in record.birthday
+        today = datetime.today()                      # one clock snapshot
+        return self.cache.get(
+            ("search_birthday", days, today.date()),  # expires next day
+            lambda: self.birthday_names(today, days)
         )
 
+    def birthday_names(self, today: datetime, days: int) -> list[str]:
+        if self.birthdays is None:
+            self.birthdays_scan()
+        result = set()
+        for (month, day), (end_month, end_day) in birthday_ranges(today, days):
+            start = bisect_left(self.birthdays, (month, day))
+            end = bisect_left(self.birthdays, (end_month, end_day + 1))
+            result.update(name for _, _, name in self.birthdays[start:end])
+        return sorted(result)
+
+    def search_fuzzy(self, search_str: str, max_distance=1,
+                     wait=True) -> list[str]:
+        # names within the edit distance, closest first; without `wait`,
+        # nothing while a background scan is still running
+        if self.fuzzy is None and self.fuzzy_scanner is not None:
+            self.take_fuzzy(wait)
+            if self.fuzzy is None:
+                return []
+        if self.fuzzy is None:
+            self.fuzzy_scan()
+        matches = self.fuzzy.search(search_str.lower(), max_distance)
+        return [name for _, name in matches]
+
+    def search_phone(self, phone: str) -> list[str]:
+        if self.phones is None:
+            self.phones_scan()
+        return sorted(self.phones.get(phone, ()))
+
+    def iter_search(self, search_str=None):
+        # unsorted matches
+        if not search_str:
+            yield from self.data
+            return
+        if self.ngrams is None:
+            self.ngrams_scan()
+        lower = search_str.lower()
+        names = self.ngrams.candidates(lower)
+        if names is None:                             # shorter than n-gram
+            names = self.data.keys()
+        elif len(lower) == self.ngrams.size:
+            yield from names                          # the n-gram itself
+            return
+        if not search_str.isdigit():                  # only names can match
+            yield from (name for name in names if lower in name.lower())
+            return
+        for name in names:
+            if search_str in self.data[name]:
+                yield name
+
     def search(self, search_str=None) -> list[str]:
-        if search_str:
-            return sorted(
-                name for name, record in self.data.items()
-                if search_str in record
-            )
-        else:
-            return sorted(self.data.keys())
-
-    def from_dict(self, source: dict):
-        for k, v in source.items():
-            self.data[k] = Record(
-                Name(v["name"]),
-                birthday=Birthday(v["birthday"]) if v["birthday"] else None,
-                email=Email(v["email"]) if v["email"] else None,
-                phone=[Phone(x) for x in v["phone"]],
-            )
+        return self.cache.get(
+            ("search", search_str),
+            lambda: sorted(self.iter_search(search_str))
+        )
+
+    def search_page(self, search_str=None, limit=20, after=None) -> list[str]:
+        # first `limit` sorted matches after the `after` cursor
+        return self.cache.get(
+            ("search_page", search_str, limit, after),
+            lambda: self.names_page(search_str, limit, after)
+        )
+
+    def names_page(self, search_str, limit: int, after) -> list[str]:
+        names = self.iter_search(search_str)
+        if after is not None:
+            names = (name for name in names if name > after)
+        return nsmallest(limit, names)
+
+    def from_dict(self, source: dict, trusted: bool = False):
+        if trusted:                                   # keys are the names
+            self.data.update(source)
+            return
+        for v in source.values():
+            record = Record.from_dict(v)
+            self.data[record.name.value] = record     # key shares the name
 
     def read_from_file(self):
         self.save_changes = False
-        if self.file_path.exists():
-            with open(self.file_path, "r", encoding="utf-8") as f:
+        gc.disable()                                  # no cycles to collect
+        try:
+            if is_fresh(self.snapshot_path, self.file_path) and \
+                    (sections := read_snapshot(self.snapshot_path, b"AB")):
+                self.from_snapshot(sections)
+            elif self.file_path.exists():
+                self.read_source()
+            self.indexes_scan()
+        finally:
+            gc.enable()
+        self.replay_journal()
+
+    def read_source(self):
+        # a file of write_to_file is trusted if its records match the crc32;
+        # any other JSON object of records is validated
+        with open(self.file_path, "rb") as f:
+            data = f.read()
+        try:
+            source, trusted = json.loads(data), False
+        except json.decoder.JSONDecodeError:
+            print(f"ERROR: File {self.file_path} could not be decoded")
+            return
+        if isinstance(source.get("format_version"), int) \
+                and "records" in source:
+            body = data[data.find(b"\n") + 1:data.rfind(b"}")]
+            trusted = source["format_version"] == FORMAT_VERSION \
+                and source.get("crc32") == zlib.crc32(body)
+            source = source["records"]
+        self.from_dict(source, trusted)
+
+    def log(self, action: str, *args):
+        if self.journal:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps([action, *args]) + "\n")
+            self.journal_size += 1
+            if self.journal_size >= JOURNAL_LIMIT:
+                self.write_to_file()                  # compaction
+
+    def replay(self, action: str, args: list):
+        if action == "add_record":
+            self.add_record(Record.from_dict(args[0]))
+        elif action == "delete_record":
+            self.delete_record(args[0])
+        elif action == "add_phone":
+            self.add_phone(args[0], [Phone(x) for x in args[1]])
+        elif action == "delete_phone":
+            self.delete_phone(args[0], Phone(args[1]))
+        elif action == "update_birthday":
+            self.update_birthday(args[0], args[1] and Birthday(args[1]))
+        elif action == "update_email":
+            self.update_email(args[0], args[1] and Email(args[1]))
+
+    def replay_journal(self):
+        self.journal_size = 0
+        if not self.journal_path.exists():
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
                 try:
-                    self.from_dict(json.load(f))
+                    action, *args = json.loads(line)
                 except json.decoder.JSONDecodeError:
-                    print(f"ERROR: File {self.file_path} could not be decoded")
+                    print(f"ERROR: Journal {self.journal_path} is truncated")
+                    break
+                try:
+                    self.replay(action, args)
+                except (KeyError, ValueError):        # already in snapshot
+                    pass
+                self.journal_size += 1
 
     def to_dict(self) -> dict:
+        # list() copies the items at once, so a writer thread never sees
+        # the dict changing size while it iterates
+        # the deferred records are written as they were read
         return {
-            k: {
-                "name": v.name.value,
-                "birthday": v.birthday.to_date_str() if v.birthday else None,
-                "email": v.email.value if v.email else None,
-                "phone": [p.value for p in v.phone],
-            }
-            for k, v in self.data.items()
+            k: v if type(v) is dict else v.to_dict()
+            for k, v in list(self.data.items())
         }
 
+    def to_snapshot(self) -> list[tuple]:
+        birthdays, phone_counts, strings = [], [], []
+        for name, record in list(self.data.items()):
+            birthday, email, phones = record_fields(record)
+            birthdays.append(
+                date.fromisoformat(birthday).toordinal() if birthday else 0
+            )
+            phone_counts.append(len(phones))
+            strings.append(name)
+            strings.append(email or "")
+            strings.extend(phones)
+        return [(INTS, birthdays), (INTS, phone_counts), (STRINGS, strings)]
+
+    def from_snapshot(self, sections: list):
+        birthdays, phone_counts, strings = sections
+        position = 0
+        for birthday, phone_count in zip(birthdays, phone_counts):
+            end = position + 2 + phone_count
+            name = strings[position]
+            self.data[name] = {                       # built on first access
+                "name": name,
+                "birthday":
+                    date.fromordinal(birthday).isoformat() if birthday
+                    else None,
+                "email": strings[position + 1] or None,
+                "phone": strings[position + 2:end],
+            }
+            position = end
+
     def write_to_file(self):
-        if self.save_changes:
-            with open(self.file_path, "w", encoding="utf-8") as f:
-                json.dump(self.to_dict(), f)
-                self.save_changes = False
+        with self.write_lock:
+            if self.save_changes:
+                self.save_changes = False   # edits from now on are saved later
+                body = json.dumps(self.to_dict()).encode()
+                header = json.dumps({
+                    "format_version": FORMAT_VERSION,
+                    "crc32": zlib.crc32(body),
+                    "records": None,
+                })
+                tmp_path = self.file_path.with_suffix(".tmp")
+                with open(tmp_path, "wb") as f:             # one JSON object
+                    f.write(header[:-len("null}")].encode() + b"\n")
+                    f.write(body + b"}")
+                tmp_path.replace(self.file_path)
+                write_snapshot(self.snapshot_path, b"AB", self.to_snapshot())
+            self.journal_path.unlink(missing_ok=True)
+            self.journal_size = 0
@@ -0,0 +1,35 @@
+from threading import Event, Thread
+
+AUTOSAVE_DELAY = 2.0        # seconds an edit may stay only in memory
+
+
+class AutoSaver(Thread):
+    # writes changed books in the background, off the input thread
+    def __init__(self, *books, delay: float = AUTOSAVE_DELAY):
+        super().__init__(daemon=True)
+        self.books = books
+        self.delay = delay
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.delay):
+            self.save()
+
+    def save(self, compact=False):
+        # a journaled book is already durable; it is only rewritten (and
+        # its journal compacted) on exit
+        for book in self.books:
+            if book.save_changes and (
+                compact or not getattr(book, "journal", False)
+            ):
+                try:
+                    book.write_to_file()
+                except OSError as e:
+                    print(f"ERROR: {book.file_path} could not be saved: {e}")
+
+    def stop(self):
+        # waits for the current write and flushes what is left
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        self.save(compact=True)
@@ -1,12 +1,18 @@
 from re import search
 from pathlib import Path
+from datetime import date
 from addrbook import AddressBook, Record, Phone, Birthday, Name, Email
 from notebook import NoteBook
 from clean import SortFolder
+from importer import import_contacts, errors_path
+from tagquery import is_tag_query
+from autosave import AutoSaver
 from abc import abstractmethod, ABCMeta
 from os import system
 
 LINE = "-" * 60
+PAGE_SIZE = 20
+NEXT_PAGE = "+"
 
 
 def yellow(string: str) -> str:
@@ -62,11 +68,30 @@ class Helper(metaclass=ABCMeta):
     def sort_folder(self):
         pass
 
+    @abstractmethod
+    def import_contacts(self):
+        pass
+
+    @abstractmethod
+    def search_notes_ranked(self):
+        pass
+
+    @abstractmethod
+    def search_notes_by_date(self):
+        pass
+
+    @abstractmethod
+    def merge_duplicate_notes(self):
+        pass
+
 
 class BotHelper(Helper):
     def __init__(self):
-        self.contacts = AddressBook()
+        self.contacts = AddressBook(journal=True)
+        self.contacts.start_fuzzy_scan()              # for search_contacts
         self.notes = NoteBook()
+        self.autosave = AutoSaver(self.contacts, self.notes)
+        self.autosave.start()
         self.print_main_menu = True
         system("")
 
@@ -92,9 +117,13 @@ class BotHelper(Helper):
         print("7 = Search notes using text")
         print("8 = Search notes using hashtag")
         print("9 = Sort files")
+        print("10 = Import contacts (CSV/vCard)")
+        print("11 = Search notes by relevance")
+        print("12 = Search notes by date")
+        print("13 = Merge near-duplicate notes")
         print("0 = Exit (Ctrl+C)")
         print(LINE)
-        print("NB: Options from 3 to 8 allow to select one item for update")
+        print("NB: Options 3-8, 11 and 12 allow to select one item for update")
         print(LINE)
 
     def get_user_input(self, message: str) -> bool:
@@ -117,26 +146,33 @@ class BotHelper(Helper):
         elif self.user_input == "2":            # = Add new note
             self.add_note()
         elif self.user_input == "3":            # = Show all contacts
-            self.show_contacts(self.contacts.search())
+            self.show_contact_pages()
         elif self.user_input == "4":            # = Search by birthday
             self.search_contacts_by_birthday()
         elif self.user_input == "5":            # = Search name & phone
             self.search_contacts()
         elif self.user_input == "6":            # = Show all notes
-            self.show_notes(self.notes.search_text())
+            self.show_note_pages()
         elif self.user_input == "7":            # = Search notes (text)
             self.search_notes()
         elif self.user_input == "8":            # = Search notes (hashtag)
             self.search_notes_by_hashtag()
         elif self.user_input == "9":            # = Sort folder
             self.sort_folder()
+        elif self.user_input == "10":           # = Import contacts
+            self.import_contacts()
+        elif self.user_input == "11":           # = Search notes (ranked)
+            self.search_notes_ranked()
+        elif self.user_input == "12":           # = Search notes (date)
+            self.search_notes_by_date()
+        elif self.user_input == "13":           # = Merge duplicate notes
+            self.merge_duplicate_notes()
         else:
             print(red("Unrecognized command"))
             self.print_main_menu = False
 
     def exit(self):
-        self.contacts.write_to_file()
-        self.notes.write_to_file()
+        self.autosave.stop()
         print(yellow("Good bye!"))
         exit()
 
@@ -182,6 +218,7 @@ class BotHelper(Helper):
                 print(red(f"{e}"))
             else:
                 print(f"Phone '{phones[-1]}' added.")
+                self.show_phone_owners(phones[-1])
         self.contacts.add_record(Record(name, birthday, email, phones))
         print(f"\nContact '{name}' successfully added.")
 
@@ -225,9 +262,30 @@ class BotHelper(Helper):
 
     def search_contacts(self):
         if self.get_user_input("Enter a pattern to search contacts: "):
-            self.show_contacts(self.contacts.search(self.user_input))
+            if self.user_input and \
+                    not self.contacts.search_page(self.user_input, 1):
+                similar = self.contacts.search_fuzzy(
+                    self.user_input, wait=False     # none until scanned
+                )
+                if similar:
+                    print(white("\nNo exact matches, similar names:"))
+                    self.show_contacts(similar)
+                    return
+            self.show_contact_pages(self.user_input)
+
+    def show_contact_pages(self, search_str: str = None):
+        after = None
+        while True:
+            name_list = self.contacts.search_page(
+                search_str, PAGE_SIZE + 1, after
+            )
+            more = len(name_list) > PAGE_SIZE
+            if not self.show_contacts(name_list[:PAGE_SIZE], more=more):
+                return
+            after = name_list[PAGE_SIZE - 1]
 
-    def show_contacts(self, name_list: list[str], select=True):
+    def show_contacts(self, name_list: list[str], select=True, more=False):
+        # returns True if the next page is requested
         if name_list:
             headers = [" Row", "User", "Birthday", "e-mail", "Phone number(s)"]
             format_str = "{:>5} {:<40} {:<27} {:<30} {:<20}"
@@ -240,17 +298,23 @@ class BotHelper(Helper):
             print(line)
             if select:
                 row_list = list(range(len(name_list)))
-                row = self.get_row_number(row_list, "contact")
+                row = self.get_row_number(row_list, "contact", more)
+                if row == NEXT_PAGE:
+                    return True
                 if row is None:
                     print("\nNo contacts selected")
                 else:
                     self.edit_contact(name_list[row])
         else:
             print(white("\n0 contacts found"))
+        return False
 
-    def get_row_number(self, rows: list[int], item: str) -> int:
-        message = f"Type row number to select a {item} ('Enter' to skip): "
+    def get_row_number(self, rows: list[int], item: str, more=False) -> int:
+        message = f"Type row number to select a {item} ('Enter' to skip"
+        message += f", '{NEXT_PAGE}' for next page): " if more else "): "
         while self.get_user_input(white(message)):
+            if more and self.user_input == NEXT_PAGE:
+                return NEXT_PAGE
             try:
                 row_number = int(self.user_input)
             except ValueError:
@@ -319,11 +383,19 @@ class BotHelper(Helper):
                 print(red(f"{e}"))
             else:
                 if self.contacts.add_phone(name, phone):
+                    self.show_phone_owners(phone, name)
                     print(f"\nContact '{name}' successfully updated.")
                     return
                 else:
                     print(red("Duplicate phone number"))
 
+    def show_phone_owners(self, phone: Phone, name: str = None):
+        owners = [x for x in self.contacts.search_phone(phone.value)
+                  if x != name]
+        if owners:
+            print(white(f"Phone '{phone}' also belongs to: "
+                        + ", ".join(owners)))
+
     def delete_phone(self, name: str):
         if self.contacts[name].phone:
             print(LINE)
@@ -391,13 +463,83 @@ class BotHelper(Helper):
 
     def search_notes(self):
         if self.get_user_input("Enter a text pattern to search notes: "):
-            self.show_notes(self.notes.search_text(self.user_input))
+            self.show_note_pages(self.user_input)
+
+    def search_notes_ranked(self):
+        if self.get_user_input("Enter words to search notes: "):
+            self.show_notes(
+                self.notes.search_ranked(self.user_input, PAGE_SIZE)
+            )
+
+    def search_notes_by_date(self):
+        message = "Enter dates 'from to' (YYYY-MM-DD or '-' for any): "
+        while self.get_user_input(message):
+            try:
+                start, end = [
+                    None if x == "-" else date.fromisoformat(x)
+                    for x in self.user_input.split()
+                ]
+            except ValueError:
+                print(red("Two dates or '-' expected"))
+            else:
+                break
+        else:
+            return
+        if not self.get_user_input("Enter a text pattern (optional): "):
+            return
+        note_id_list = self.notes.search_created(
+            start, end, self.user_input or None
+        )
+        position = 0
+        while self.show_notes(
+            note_id_list[position:position + PAGE_SIZE],
+            more=len(note_id_list) > position + PAGE_SIZE
+        ):
+            position += PAGE_SIZE
+
+    def merge_duplicate_notes(self):
+        clusters = self.notes.duplicate_clusters()
+        if not clusters:
+            print(white("\n0 near-duplicate notes found"))
+            return
+        for i, note_id_list in enumerate(clusters, 1):
+            print(yellow(f"\n[ NEAR-DUPLICATES {i} OF {len(clusters)} ]"))
+            self.show_notes(note_id_list, select=False)
+            note_id = note_id_list[-1]                  # the latest text
+            message = f"Merge into note {note_id}, deleting the others?(Y)"
+            if not self.get_user_input(yellow(message)):
+                return
+            if self.user_input.lower().startswith("y"):
+                self.notes.merge_notes(note_id, note_id_list)
+                print(white(f"\nNotes merged into note {note_id}."))
 
     def search_notes_by_hashtag(self):
-        if self.get_user_input("Enter a text pattern to search tags: "):
-            self.show_notes(self.notes.search_tag(self.user_input))
+        print("Use AND, OR, NOT and ( ) to combine whole tags")
+        if not self.get_user_input("Enter a text pattern to search tags: "):
+            return
+        if is_tag_query(self.user_input):
+            try:
+                note_id_list = self.notes.search_tag_query(self.user_input)
+            except ValueError as e:
+                print(red(f"{e}"))
+                return
+        else:
+            note_id_list = self.notes.search_tag(self.user_input)
+        self.show_notes(note_id_list)
 
-    def show_notes(self, note_id_list: list[int], select=True):
+    def show_note_pages(self, search_str: str = None):
+        after = None
+        while True:
+            note_id_list = self.notes.search_text_page(
+                search_str, PAGE_SIZE + 1, after
+            )
+            more = len(note_id_list) > PAGE_SIZE
+            if not self.show_notes(note_id_list[:PAGE_SIZE], more=more):
+                return
+            after = note_id_list[PAGE_SIZE - 1]
+
+    def show_notes(self, note_id_list: list[int], select=True, more=False):
+        # returns True if the next page is requested
         if note_id_list:
             headers = ["Row ", "Date   ", "Note", "[Hashtags]"]
             format_str = "{:>5} {:>10} {:<60} {:<1}"
@@ -413,13 +555,16 @@ class BotHelper(Helper):
                 print(format_str.format(*note))
             print(line)
             if select:
-                row = self.get_row_number(note_id_list, "note")
+                row = self.get_row_number(note_id_list, "note", more)
+                if row == NEXT_PAGE:
+                    return True
                 if row is None:
                     print(white("\nNo notes selected"))
                 else:
                     self.edit_note(row)
         else:
             print(white("\n0 notes found"))
+        return False
 
     def edit_note(self, note_id: int):
         self.print_edit_menu = True
@@ -519,6 +664,27 @@ class BotHelper(Helper):
             except ValueError as e:
                 print(red(f"\n{e}\n"))
 
+    def import_contacts(self):
+        print(yellow("\n[ IMPORT CONTACTS ]"))
+        print(LINE)
+        print("CSV columns: name, birthday, email, phone")
+        print("Several phones in one CSV cell are separated by ';'")
+        print(LINE)
+        if self.get_user_input(white("Enter CSV or vCard file name: ")):
+            path = Path(self.user_input)
+            if not path.is_file():
+                print(red(f"\nERROR: '{path}' does not exist."))
+                return
+            try:
+                accepted, rejected = import_contacts(self.contacts, path)
+            except ValueError as e:
+                print(red(f"\n{e}\n"))
+                return
+            print(f"\n{accepted} contacts imported.")
+            if rejected:
+                report = errors_path(path)
+                print(red(f"{len(rejected)} rows rejected, see '{report}'"))
+
 
 def run():
     menu = BotHelper()
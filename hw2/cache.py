@@ -0,0 +1,30 @@
+from collections import OrderedDict
+
+CACHE_SIZE = 64             # cached query results per book
+
+
+class QueryCache:
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        # entries of the older generations will never be returned
+        self.generation += 1
+
+    def get(self, key, compute):
+        entry = self.entries.get(key)
+        if entry and entry[0] == self.generation:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        result = compute()
+        self.entries[key] = (self.generation, result)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return result
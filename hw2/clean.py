@@ -1,7 +1,11 @@
-from re import sub
+import os
+import sqlite3
+from re import sub, compile
 from pathlib import Path
+from contextlib import closing
 from shutil import unpack_archive, ReadError
 from hashlib import md5
+from concurrent.futures import ThreadPoolExecutor
 
 # file extensions to sort
 FOLDERS = {
@@ -12,6 +16,10 @@ FOLDERS = {
     "archives": ("ZIP", "GZ", "TAR"),
 }
 RENAME_PATTERN = "_renamed_{:0>3}_"
+RENAMED = compile(r"(.*)_renamed_(\d+)_(\.[^.]*)?")
+BUFFER_SIZE = 128 * 1024
+PARTIAL_SIZE = 16 * 1024    # bytes hashed at each end before a full hash
+HASH_CACHE = ".sort_hashes.db"  # digests kept in the sorted folder
 
 
 class Normalize:
@@ -73,19 +81,124 @@ class Archives:
                     archive.unlink()
 
 
+class HashCache:
+    # digests by (device, inode) for files of unchanged size and mtime
+    @classmethod
+    def load(cls, folder: Path):
+        cls.path = folder / HASH_CACHE
+        cls.entries = {}                # (dev, inode): [size, mtime, ...]
+        if not cls.path.exists():
+            return
+        try:
+            with closing(sqlite3.connect(cls.path)) as connection:
+                for dev, inode, *entry in connection.execute(
+                    "SELECT dev, inode, size, mtime_ns, path, partial, full "
+                    "FROM hashes"
+                ):
+                    cls.entries[dev, inode] = entry
+        except sqlite3.DatabaseError:
+            print(f"Warning: could not read the hash cache '{cls.path}'.")
+
+    @classmethod
+    def get(cls, key: tuple) -> list:
+        # [size, mtime_ns, path, partial hash, full hash] or None
+        entry = getattr(cls, "entries", {}).get(key[:2])
+        if entry and tuple(entry[:2]) == key[2:]:
+            return entry
+
+    @classmethod
+    def put(cls, key: tuple, path: Path, partial=None, full=None):
+        if not hasattr(cls, "entries"):
+            return
+        entry = cls.get(key) or [*key[2:], None, None, None]
+        entry[2] = str(path)
+        entry[3] = partial or entry[3]
+        entry[4] = full or entry[4]
+        cls.entries[key[:2]] = entry
+
+    @classmethod
+    def move(cls, path: Path):
+        # records the new path of a moved file
+        if getattr(cls, "entries", None):
+            stat = path.stat()
+            key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if cls.get(key):
+                cls.put(key, path)
+
+    @classmethod
+    def save(cls):
+        # keeps the entries of the files that are still in place
+        if not hasattr(cls, "entries"):
+            return
+        rows = []
+        for (dev, inode), (size, mtime_ns, path, partial, full) \
+                in cls.entries.items():
+            try:
+                stat = Path(path).stat()
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns) \
+                    == (dev, inode, size, mtime_ns):
+                rows.append((dev, inode, size, mtime_ns, path, partial, full))
+        with closing(sqlite3.connect(cls.path)) as connection:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS hashes (dev INTEGER, "
+                    "inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+                    "path TEXT, partial TEXT, full TEXT, "
+                    "PRIMARY KEY (dev, inode))"
+                )
+                connection.execute("DELETE FROM hashes")
+                connection.executemany(
+                    "INSERT INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+        del cls.entries
+
+
 class FileWithHash:
     def __init__(self, path, calc_hash: bool = False):
         self.path = Path(path)
         self.md5_hash = None
+        self.partial_hash = None
+        self.size = None
+        self.key = None
         if calc_hash:
             self.calc_hash()
 
     def __getattr__(self, attr):
         return getattr(self.path, attr)
 
+    def calc_size(self):
+        # also takes the cached hashes of the file
+        if self.size is None and self.path.is_file():
+            stat = self.path.stat()
+            self.size = stat.st_size
+            self.key = (stat.st_dev, stat.st_ino, stat.st_size,
+                        stat.st_mtime_ns)
+            if entry := HashCache().get(self.key):
+                self.partial_hash = self.partial_hash or entry[3]
+                self.md5_hash = self.md5_hash or entry[4]
+
+    def calc_partial_hash(self):
+        # hash of the size and both ends; the full hash for small files
+        self.calc_size()
+        if self.size is None or self.partial_hash:
+            return
+        if self.size <= 2 * PARTIAL_SIZE:
+            self.calc_hash()
+            self.partial_hash = self.md5_hash
+            return
+        md5_hash = md5(str(self.size).encode())
+        with open(self.path, "rb") as f:
+            md5_hash.update(f.read(PARTIAL_SIZE))
+            f.seek(-PARTIAL_SIZE, 2)
+            md5_hash.update(f.read(PARTIAL_SIZE))
+        self.partial_hash = md5_hash.hexdigest()
+        HashCache().put(self.key, self.path, partial=self.partial_hash)
+
     def calc_hash(self):
-        BUFFER_SIZE = 128 * 1024
-        if self.path.is_file():
+        self.calc_size()
+        if self.size is not None and not self.md5_hash:
             md5_hash = md5()
             with open(self.path, "rb") as f:
                 while True:
@@ -94,31 +207,163 @@ class FileWithHash:
                         break
                     md5_hash.update(data)
             self.md5_hash = md5_hash.hexdigest()
+            HashCache().put(self.key, self.path, full=self.md5_hash)
+
+    def __eq__(self, other):
+        # same size, then same ends, then same contents
+        if not isinstance(other, FileWithHash):
+            return NotImplemented
+        for stage, key in STAGES:
+            for file in (self, other):
+                if key(file) is None:
+                    stage(file)
+            if key(self) is None or key(self) != key(other):
+                return False
+        return True
+
+
+STAGES = (
+    (FileWithHash.calc_size, lambda file: file.size),
+    (FileWithHash.calc_partial_hash, lambda file: file.partial_hash),
+    (FileWithHash.calc_hash, lambda file: file.md5_hash),
+)
+
+
+def group_by(files: list[FileWithHash], key) -> list[list[FileWithHash]]:
+    # groups of two or more files with the same key value (None excluded)
+    groups = {}
+    for file in files:
+        if key(file) is not None:
+            groups.setdefault(key(file), []).append(file)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def group_duplicates(batches: list[list[FileWithHash]],
+                     workers: int = None) -> list:
+    # groups of files with equal contents within each batch; each stage runs
+    # on one thread pool for all batches (hashlib releases the GIL) and only
+    # for the files that still collide
+    groups = [list(files) for files in batches]
+    with ThreadPoolExecutor(workers) as executor:
+        for stage, key in STAGES:
+            pending = [x for group in groups for x in group if key(x) is None]
+            list(executor.map(stage, pending))
+            groups = [
+                subgroup for group in groups
+                for subgroup in group_by(group, key)
+            ]
+    return groups
+
+
+def target_name(path: Path) -> str:
+    # the folder a file is sorted into or None
+    for name, ext in FOLDERS.items():
+        if path.suffix[1:].upper() in ext:
+            return name
+    return None
 
-    def is_duplicate(self):
-        if self.path.exists():
+
+class ContentIndex:
+    # files of a target folder keyed by (size,), then (size, partial hash),
+    # then (size, partial hash, full hash); a key holds its only file, or
+    # None once a second file met it there and both went one stage deeper,
+    # so each file is hashed at most once per stage
+    def __init__(self, folder: Path, files: dict = None):
+        # `files` holds the already hashed files by path
+        self.keys: dict[tuple, FileWithHash] = {}
+        files = files or {}
+        if folder.is_dir():
+            for path in folder.iterdir():
+                if path.is_file():
+                    self.add(files.pop(path, None) or FileWithHash(path))
+
+    def add(self, file: FileWithHash):
+        self.locate(file, add=True)
+
+    def find(self, file: FileWithHash) -> FileWithHash:
+        # a file with the same contents or None
+        return self.locate(file)
+
+    def locate(self, file: FileWithHash, add=False) -> FileWithHash:
+        key = ()
+        for i, (stage, value) in enumerate(STAGES):
+            stage(file)
+            if value(file) is None:                     # not readable
+                return None
+            key += (value(file),)
+            if key not in self.keys:
+                if add:
+                    self.keys[key] = file
+                return None
+            other = self.keys[key]
+            if i == len(STAGES) - 1:                    # same contents
+                return other
+            if other is not None:                       # first collision
+                self.keys[key] = None
+                next_stage, next_value = STAGES[i + 1]
+                next_stage(other)
+                if next_value(other) is not None:
+                    self.keys[key + (next_value(other),)] = other
+        return None
+
+
+class NameRegistry:
+    # entry names of each folder listed once with os.scandir and kept up to
+    # date by the sorter, with the highest rename attempt per name
+    def __init__(self):
+        self.folders = {}           # folder: (names, stems, attempts)
+
+    def listing(self, folder: Path) -> tuple:
+        if folder not in self.folders:
+            self.folders[folder] = (set(), set(), {})
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    self.add(folder / entry.name)
+        return self.folders[folder]
+
+    def add(self, path: Path):
+        if path.parent not in self.folders:
+            return
+        names, stems, attempts = self.folders[path.parent]
+        name = os.path.normcase(path.name)
+        names.add(name)
+        position = name.find(".", 1)
+        while position != -1:       # an archive unpacks to any of its stems
+            stems.add(name[:position])
+            position = name.find(".", position + 1)
+        if match := RENAMED.fullmatch(name):
+            key = (match[1], match[3] or "")
+            attempts[key] = max(attempts.get(key, 0), int(match[2]))
+
+    def remove(self, path: Path):
+        if path.parent in self.folders:
+            self.folders[path.parent][0].discard(os.path.normcase(path.name))
+
+    def is_taken(self, path: Path) -> bool:
+        names, stems, _ = self.listing(path.parent)
+        name = os.path.normcase(path.name)
+        if name in names:
             return True
-        if self.path.parent.stem == "archives":
-            if (self.path.parent / self.path.stem).exists():
-                return True
-            if list(self.path.parent.glob(self.path.stem + ".*")):
-                return True
+        if path.parent.stem == "archives":
+            stem = os.path.normcase(path.stem)
+            return stem in names or stem in stems
         return False
 
-    def __EQ__(self, other):
-        if self.path.is_file() and other.path.is_file():
-            if self.path.stat().st_size == other.path.stat().st_size:
-                if not self.md5_hash:
-                    self.calc_hash()
-                if not other.md5_hash:
-                    other.calc_hash()
-                if self.md5_hash == other.md5_hash:
-                    return True
-        return False
+    def unique_path(self, folder: Path, new_name: str, suffix: str) -> Path:
+        new_file = folder / (new_name + suffix)
+        if not self.is_taken(new_file):
+            return new_file
+        attempts = self.listing(folder)[2]
+        key = (os.path.normcase(new_name), os.path.normcase(suffix))
+        rename_pattern = new_name + RENAME_PATTERN + suffix
+        while self.is_taken(new_file):
+            attempts[key] = attempts.get(key, 0) + 1
+            new_file = folder / rename_pattern.format(attempts[key])
+        return new_file
 
-    def update_name(self, name: str):
-        self.path = self.path.parent / name
-        self.md5_hash = None
+    def move(self, path: Path, new_path: Path):
+        self.remove(path)
+        self.add(new_path)
 
 
 class SortFolder:
@@ -128,31 +373,67 @@ class SortFolder:
         if not folder.is_dir():
             raise ValueError(f"ERROR: '{folder}' is a file (not a folder).")
         self.folder = folder
+        self.contents: dict[Path, ContentIndex] = {}
+        self.names = NameRegistry()
+        self.hashed: dict[Path, FileWithHash] = {}
 
     def start(self):
         print(f"Processing folder '{self.folder.resolve()}'...")
+        HashCache().load(self.folder)
+        self.hash_candidates()
         self.process_folder(self.folder, 0)
         Archives().unpack(self.folder)
+        HashCache().save()
         print(Counters())
 
+    def hash_candidates(self):
+        # the files bound for each target folder and the files already
+        # there are hashed in one parallel batch wherever they collide;
+        # the content indexes then find the digests in place
+        batches = {name: [] for name in FOLDERS}
+        for name, files in batches.items():
+            if (self.folder / name).is_dir():
+                files.extend(
+                    FileWithHash(path)
+                    for path in (self.folder / name).iterdir()
+                    if path.is_file()
+                )
+        for path, name in self.files_to_sort(self.folder, 0):
+            batches[name].append(FileWithHash(path))
+        group_duplicates(list(batches.values()))
+        self.hashed = {
+            file.path: file for files in batches.values() for file in files
+        }
+
+    def files_to_sort(self, folder: Path, level: int):
+        # (file, target folder name) pairs in the order of process_folder
+        for f in folder.iterdir():
+            if not level and f.name in (HASH_CACHE, HASH_CACHE + "-journal"):
+                continue
+            if f.is_dir():
+                if level or f.suffix or not f.stem.lower() in FOLDERS:
+                    yield from self.files_to_sort(f, level + 1)
+            elif name := target_name(f):
+                yield f, name
+
     def process_folder(self, folder: Path, level: int) -> bool:
         # returns True for an empty folder
         delete_empty_folder = bool(level)
         for f in folder.iterdir():
+            if not level and f.name in (HASH_CACHE, HASH_CACHE + "-journal"):
+                continue
             if f.is_dir():
                 if level or f.suffix or not f.stem.lower() in FOLDERS:
                     delete_empty_folder &= self.process_folder(f, level + 1)
+            elif name := target_name(f):
+                self.process_file(f, f.parents[level] / name)
             else:
-                for name, ext in FOLDERS.items():
-                    if f.suffix[1:].upper() in ext:
-                        self.process_file(f, f.parents[level] / name)
-                        break
-                else:
-                    Counters().inc("Unsupported extension")
-                    delete_empty_folder = False
-                    self.normalize_and_rename(f)
+                Counters().inc("Unsupported extension")
+                delete_empty_folder = False
+                self.normalize_and_rename(f)
         if delete_empty_folder:
             folder.rmdir()
+            self.names.remove(folder)
             Counters().inc("Empty folders deleted")
         else:
             self.normalize_and_rename(folder)
@@ -160,29 +441,27 @@ class SortFolder:
 
     def process_file(self, file_path: Path, target: Path):
         new_name = Normalize()(file_path.stem)
-        new_file = FileWithHash(target / (new_name + file_path.suffix))
         folder_counter = f"Files moved to '{target.stem}' folder"
-        if not Counters()[folder_counter]:              # first file of a kind?
+        if target not in self.contents:                 # first file of a kind?
             self.prepare_target_folder(target)
-        elif new_file.is_duplicate():
-            main_file = FileWithHash(file_path)
-            attempt = 0
-            rename_pattern = new_name + RENAME_PATTERN + file_path.suffix
-            while True:
-                if new_file == main_file:               # checks size and hash
-                    file_path.unlink()
-                    Counters().inc("Duplicates deleted")
-                    return
-                else:
-                    attempt += 1
-                    new_file.update_name(rename_pattern.format(attempt))
-                    if not new_file.is_duplicate():
-                        Counters().inc("Duplicates renamed")
-                        break
-        file_path.replace(new_file.path)                # move to target folder
+            self.contents[target] = ContentIndex(target, self.hashed)
+        main_file = self.hashed.pop(file_path, None) or FileWithHash(file_path)
+        if self.contents[target].find(main_file):       # same contents
+            file_path.unlink()
+            self.names.remove(file_path)
+            Counters().inc("Duplicates deleted")
+            return
+        new_path = self.names.unique_path(target, new_name, file_path.suffix)
+        if new_path.name != new_name + file_path.suffix:
+            Counters().inc("Duplicates renamed")
+        file_path.replace(new_path)                     # move to target folder
+        self.names.move(file_path, new_path)
+        HashCache().move(new_path)
+        main_file.path = new_path
+        self.contents[target].add(main_file)
         Counters().inc(folder_counter)
         if target.stem == "archives":
-            Archives().append(new_file.path)
+            Archives().append(new_path)
 
     def prepare_target_folder(self, target: Path):
         if not target.exists():
@@ -190,24 +469,23 @@ class SortFolder:
         elif target.is_file():                          # folder name occupied?
             tmp_file = self.get_unique_path(target, target.stem)
             target.replace(tmp_file)                    # temporary renaming
+            self.names.move(target, tmp_file)
             self.create_target_folder(target)
             tmp_file.replace(target / target.stem)
+            self.names.move(tmp_file, target / target.stem)
             print(f"Warning: file '{target}' was moved into that folder.")
 
     def create_target_folder(self, target: Path):
         target.mkdir()
+        self.names.add(target)
         print(f"Folder '{target}' has been created.")
 
     def normalize_and_rename(self, path: Path):
         new_name = Normalize()(path.stem)
         if new_name != path.stem:
-            path.rename(self.get_unique_path(path, new_name))
+            new_path = self.get_unique_path(path, new_name)
+            path.rename(new_path)
+            self.names.move(path, new_path)
 
     def get_unique_path(self, path: Path, new_name: str) -> Path:
-        new_file = path.parent / (new_name + path.suffix)
-        attempt = 0
-        rename_pattern = new_name + RENAME_PATTERN + path.suffix
-        while new_file.exists():
-            attempt += 1
-            new_file = path.parent / rename_pattern.format(attempt)
-        return new_file
+        return self.names.unique_path(path.parent, new_name, path.suffix)
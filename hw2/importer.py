@@ -0,0 +1,149 @@
+import csv
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from re import split, sub
+from addrbook import AddressBook, Record
+
+BATCH_SIZE = 1000           # rows validated by one worker at a time
+WINDOW = 2                  # batches in flight per worker
+
+
+def clean_phone(phone: str) -> str:
+    return sub(r"[\s+\-().]", "", phone)
+
+
+def read_csv(path: Path):
+    # columns: name, birthday, email, phone (phones separated by ';' or ',')
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            row = {(k or "").strip().lower(): (v or "").strip()
+                   for k, v in row.items()}
+            yield {
+                "name": row.get("name", ""),
+                "birthday": row.get("birthday", ""),
+                "email": row.get("email", ""),
+                "phone": [
+                    clean_phone(p)
+                    for p in split(r"[;,]", row.get("phone", "")) if p.strip()
+                ],
+            }
+
+
+def unfold(lines):
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:  # folded line
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def read_vcard(path: Path):
+    card = None
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in unfold(f):
+            key, _, value = line.partition(":")
+            key = key.split(";")[0].split(".")[-1].upper()
+            if key == "BEGIN" and value.strip().upper() == "VCARD":
+                card = {"name": "", "birthday": "", "email": "", "phone": []}
+            elif card is not None:
+                if key == "END":
+                    yield card
+                    card = None
+                else:
+                    read_vcard_line(card, key, value)
+
+
+def read_vcard_line(card: dict, key: str, value: str):
+    if key == "FN":
+        card["name"] = value.strip()
+    elif key == "N" and not card["name"]:               # family;given;...
+        card["name"] = " ".join(
+            x.strip() for x in reversed(value.split(";")[:2]) if x.strip()
+        )
+    elif key == "BDAY":
+        value = value.strip()[:10]
+        if len(value) == 8 and value.isdigit():         # yyyymmdd
+            value = f"{value[:4]}-{value[4:6]}-{value[6:]}"
+        card["birthday"] = value
+    elif key == "EMAIL" and not card["email"]:
+        card["email"] = value.strip()
+    elif key == "TEL":
+        card["phone"].append(clean_phone(value))
+
+
+def validate_rows(rows: list[tuple[int, dict]]) -> tuple[list, list]:
+    # runs in a worker process: returns valid rows and (row, error) pairs
+    accepted, rejected = [], []
+    for row_number, row in rows:
+        try:
+            if not row["name"]:
+                raise ValueError("Name is required")
+            record = Record.from_dict(row)
+        except ValueError as e:
+            rejected.append((row_number, str(e)))
+        else:
+            accepted.append(record.to_dict())
+    return accepted, rejected
+
+
+def batches(rows, size: int = BATCH_SIZE):
+    rows = enumerate(rows, 1)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def validated(rows, workers=None):
+    # (valid rows, errors) of each batch in file order; the file is read
+    # only a bounded window of batches ahead of the results
+    window = WINDOW * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for batch in batches(rows):
+            pending.append(executor.submit(validate_rows, batch))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def errors_path(path: Path) -> Path:
+    # x.csv and x.vcf get separate reports
+    return path.with_name(path.name + ".errors.txt")
+
+
+def import_contacts(book: AddressBook, path: Path, workers=None) -> tuple:
+    # returns (number of accepted rows, list of (row, error) pairs)
+    path = Path(path)
+    if path.suffix.lower() in (".vcf", ".vcard"):
+        rows = read_vcard(path)
+    elif path.suffix.lower() == ".csv":
+        rows = read_csv(path)
+    else:
+        raise ValueError(f"ERROR: '{path}' is not a CSV or vCard file.")
+    accepted, rejected = 0, []
+
+    def records():                                  # merged as validated
+        nonlocal accepted
+        for valid, errors in validated(rows, workers):
+            accepted += len(valid)
+            rejected.extend(errors)
+            for row in valid:
+                yield Record.from_dict(row, trusted=True)
+
+    book.merge(records())
+    if rejected:
+        with open(errors_path(path), "w", encoding="utf-8") as f:
+            for row_number, error in rejected:
+                f.write(f"row {row_number}: {error}\n")
+    else:                                           # no stale report
+        errors_path(path).unlink(missing_ok=True)
+    return accepted, rejected
@@ -0,0 +1,293 @@
+from collections import Counter
+from heapq import nlargest
+from math import log
+from re import compile
+
+WORD = compile(r"\w+")
+BM25_K1 = 1.2               # term frequency saturation
+BM25_B = 0.75               # text length normalization
+BINS = 32                   # MinHash signature size
+ROWS = 4                    # signature bins per LSH band
+SIMILARITY = 0.6            # estimated similarity of near-duplicates
+MASK = (1 << 64) - 1
+PAIRS_LIMIT = 64            # larger buckets are compared with leaders only
+
+
+class NGramIndex:
+    def __init__(self, size: int = 3):
+        self.size = size
+        self.postings: dict[str, set] = {}
+
+    def grams(self, text: str) -> set[str]:
+        return {
+            text[i:i + self.size] for i in range(len(text) - self.size + 1)
+        }
+
+    def add(self, key, grams: set[str]):
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(key)
+
+    def delete(self, key, grams: set[str]):
+        for gram in grams:
+            keys = self.postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+
+    def candidates(self, text: str):
+        # keys having every n-gram of the text (None if text is too short)
+        grams = self.grams(text)
+        if not grams:
+            return None
+        postings = sorted(
+            (self.postings.get(gram, set()) for gram in grams), key=len
+        )
+        return postings[0].intersection(*postings[1:])
+
+
+class TextIndex:
+    # word -> {key: count}, with an n-gram index over the words for
+    # substrings and the text lengths for ranking
+    def __init__(self):
+        self.postings: dict[str, dict] = {}
+        self.vocabulary = NGramIndex()
+        self.lengths = {}
+        self.total = 0
+
+    @staticmethod
+    def words(text: str) -> Counter:
+        return Counter(WORD.findall(text))
+
+    def add(self, key, text: str):
+        words = self.words(text)
+        for word, count in words.items():
+            if word not in self.postings:
+                self.postings[word] = {}
+                self.vocabulary.add(word, self.vocabulary.grams(word))
+            self.postings[word][key] = count
+        self.lengths[key] = sum(words.values())
+        self.total += self.lengths[key]
+
+    def delete(self, key, text: str):
+        for word in self.words(text):
+            keys = self.postings[word]
+            del keys[key]
+            if not keys:
+                del self.postings[word]
+                self.vocabulary.delete(word, self.vocabulary.grams(word))
+        self.total -= self.lengths.pop(key)
+
+    def words_with(self, part: str) -> list[str]:
+        words = self.vocabulary.candidates(part)
+        if words is None:                             # shorter than n-gram
+            words = self.postings
+        return [word for word in words if part in word]
+
+    def candidates(self, text: str):
+        # keys whose texts may contain the text (None if any key may);
+        # a word inside the text must be a whole word of a matching text
+        keys = None
+        for match in WORD.finditer(text):
+            if match.start() and match.end() < len(text):
+                found = self.postings.get(match.group(), {}).keys()
+            else:
+                found = set().union(*(
+                    self.postings[word] for word in self.words_with(
+                        match.group()
+                    )
+                ))
+            keys = found if keys is None else keys & found
+            if not keys:
+                break
+        return keys
+
+    def rank(self, text: str, k: int) -> list[tuple[float, object]]:
+        # (BM25 score, key) pairs of the k best texts for the words of text
+        scores = {}
+        if not self.lengths:
+            return []
+        average = self.total / len(self.lengths) or 1
+        for word in set(WORD.findall(text)):
+            keys = self.postings.get(word, {})
+            idf = log(
+                (len(self.lengths) - len(keys) + 0.5) / (len(keys) + 0.5) + 1
+            )
+            for key, count in keys.items():
+                norm = 1 - BM25_B + BM25_B * self.lengths[key] / average
+                scores[key] = scores.get(key, 0) + idf * count * (
+                    BM25_K1 + 1
+                ) / (count + BM25_K1 * norm)
+        return nlargest(k, ((score, key) for key, score in scores.items()))
+
+
+class MinHashIndex:
+    # one-permutation MinHash signatures of the word pairs of a text with
+    # LSH bands of ROWS bins; texts whose signatures agree in at least
+    # `similarity` of the bins are near-duplicates (see
+    # benchmarks/bench_duplicates.py for the recall of these settings)
+    def __init__(self, similarity: float = SIMILARITY):
+        self.similarity = similarity
+        self.signatures = {}
+        self.buckets = [{} for _ in range(BINS // ROWS)]
+
+    @staticmethod
+    def signature(words: list[str]) -> tuple:
+        shingles = zip(words, words[1:]) if len(words) > 1 else words
+        hashes = sorted({hash(x) & MASK for x in shingles}, reverse=True)
+        mins = {h % BINS: h // BINS for h in hashes}  # the smallest wins
+        signature = []
+        for i in range(BINS):                   # an empty bin borrows the
+            j = i                               # next filled one
+            while j not in mins:
+                j = (j + 1) % BINS
+            signature.append(mins[j] * BINS + (j - i) % BINS)
+        return tuple(signature)
+
+    def bands(self, signature: tuple) -> list[tuple]:
+        return [signature[i:i + ROWS] for i in range(0, BINS, ROWS)]
+
+    def add(self, key, words: list[str]):
+        if not words:
+            return
+        signature = self.signature(words)
+        self.signatures[key] = signature
+        for buckets, band in zip(self.buckets, self.bands(signature)):
+            buckets.setdefault(band, set()).add(key)
+
+    def delete(self, key):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for buckets, band in zip(self.buckets, self.bands(signature)):
+            keys = buckets[band]
+            keys.discard(key)
+            if not keys:
+                del buckets[band]
+
+    def similar(self, a, b) -> float:
+        # estimated Jaccard similarity of the word pairs
+        return sum(map(
+            int.__eq__, self.signatures[a], self.signatures[b]
+        )) / BINS
+
+    def search(self, key) -> list[tuple[float, object]]:
+        # (similarity, key) pairs of the near-duplicates, the closest first
+        if key not in self.signatures:
+            return []
+        candidates = set().union(*(
+            buckets[band] for buckets, band in zip(
+                self.buckets, self.bands(self.signatures[key])
+            )
+        ))
+        candidates.discard(key)
+        return sorted((
+            (s, other) for other in candidates
+            if (s := self.similar(key, other)) >= self.similarity
+        ), key=lambda x: (-x[0], x[1]))
+
+    def clusters(self) -> list[list]:
+        # groups of keys linked by near-duplicate pairs; in a bucket
+        # larger than PAIRS_LIMIT a key is only compared with the keys
+        # that were not close to any earlier one
+        parents = {}
+
+        def find(key):
+            while parents.get(key, key) != key:
+                key = parents[key]
+            return key
+
+        for buckets in self.buckets:
+            for keys in buckets.values():
+                leaders = []
+                for key in keys:
+                    linked = False
+                    for other in leaders:
+                        if self.similar(key, other) >= self.similarity:
+                            linked = True
+                            a, b = find(key), find(other)
+                            if a != b:
+                                parents[max(a, b)] = min(a, b)
+                    if not linked or len(keys) <= PAIRS_LIMIT:
+                        leaders.append(key)
+        groups = {}
+        for key in parents:
+            root = find(key)
+            groups.setdefault(root, [root]).append(key)
+        return sorted(sorted(group) for group in groups.values())
+
+
+def levenshtein(a: str, b: str) -> int:
+    size = min(len(a), len(b))
+    prefix = 0
+    while prefix < size and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < size - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    a, b = a[prefix:len(a) - suffix], b[prefix:len(b) - suffix]
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        left = i
+        for j, char_b in enumerate(b):
+            left = min(previous[j + 1] + 1, left + 1,
+                       previous[j] + (char_a != char_b))
+            current.append(left)
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    def __init__(self, distance=levenshtein):
+        self.distance = distance
+        self.root = None            # node is (word, {distance: node})
+        self.size = 0               # deleted words stay in the tree
+        self.postings: dict[str, set] = {}
+
+    def add(self, key, word: str):
+        if word not in self.postings:
+            self.insert(word)
+        self.postings.setdefault(word, set()).add(key)
+
+    def insert(self, word: str):
+        if self.root is None:
+            self.root = (word, {})
+            self.size = 1
+            return
+        node = self.root
+        while (d := self.distance(word, node[0])) != 0:
+            if d not in node[1]:
+                node[1][d] = (word, {})
+                self.size += 1
+                return
+            node = node[1][d]
+
+    def delete(self, key, word: str):
+        keys = self.postings[word]
+        keys.discard(key)
+        if not keys:
+            del self.postings[word]
+            if self.size > 2 * len(self.postings) + 64:
+                self.rebuild()
+
+    def rebuild(self):
+        self.root, self.size = None, 0
+        for word in self.postings:
+            self.insert(word)
+
+    def search(self, word: str, k: int) -> list[tuple[int, str]]:
+        # (distance, key) pairs within distance k, closest first
+        result = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_word, children = stack.pop()
+            d = self.distance(word, node_word)
+            if d <= k and node_word in self.postings:
+                result.extend((d, key) for key in self.postings[node_word])
+            stack.extend(
+                child for dist, child in children.items()
+                if d - k <= dist <= d + k
+            )
+        return sorted(result)
@@ -1,44 +1,180 @@
+import gc
 import json
+import os
 from pathlib import Path
-from datetime import datetime
+from threading import Lock
+from datetime import datetime, date
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+from heapq import nsmallest
+from itertools import islice
 from re import search
+from cache import QueryCache
+from indexes import NGramIndex, TextIndex, MinHashIndex, WORD
+from tagquery import TagQuery, Bitmap, evaluate, is_tag_query
+from snapshot import read_snapshot, write_snapshot, is_fresh, BlobStore, \
+    INTS, STRINGS, TEXTS
 
 DATE_FORMAT = "%Y-%m-%d"
+BLOB_SLACK = 1 << 20        # unused blob bytes allowed beyond the live ones
+SHARD_SIZE = 10000          # note ids per shard file
+
+
+class LazyNote(dict):
+    # note whose text is read from the mapped snapshot until it is updated
+    __slots__ = ("texts", "index")
+
+    def __init__(self, texts, index: int, created: str, tags: list[str]):
+        self["created"] = created
+        self["tags"] = tags
+        self.texts = texts
+        self.index = index
+
+    def __missing__(self, key: str):
+        if key == "text":
+            return self.texts[self.index]
+        raise KeyError(key)
 
 
 class NoteBook():
-    def __init__(self, filename="nb.json"):
+    def __init__(self, filename="nb.json", blob_storage=False, sharded=False):
         self.file_path = Path(filename)
+        self.snapshot_path = self.file_path.with_suffix(".snapshot")
+        self.index_path = self.file_path.with_suffix(".index")
+        self.shard_path = self.file_path.with_suffix(".shards")
+        self.blob_storage = blob_storage
+        self.sharded = sharded
+        self.blobs = None
+        self.cache = QueryCache()
+        self.write_lock = Lock()
         self.read_from_file()
 
-    def add_id_to_tags(self, note_id: int):
+    def mark_changed(self, note_id: int):
+        self.dirty_shards.add(note_id // SHARD_SIZE)
+        self.save_changes = True
+        self.cache.invalidate()
+
+    def mark_all_changed(self):
+        # every shard with notes or with a file to replace or remove
+        self.dirty_shards = {note_id // SHARD_SIZE for note_id in self.data}
+        self.dirty_shards.update(
+            int(path.stem) for path in self.shard_path.glob("*.snapshot")
+        )
         self.save_changes = True
+        self.cache.invalidate()
+
+    def add_id_to_tags(self, note_id: int):
+        self.mark_changed(note_id)
+        if self.tag_bits is not None:
+            self.note_bits.add(note_id)
         if self.data[note_id]['tags']:
             for tag in self.data[note_id]['tags']:
-                self.tags.setdefault(tag, []).append(note_id)
+                self.add_to_tag(tag, note_id)
         else:
-            self.tags.setdefault("#", []).append(note_id)
+            self.add_to_tag("#", note_id)
 
     def delete_id_from_tags(self, note_id: int):
-        self.save_changes = True
+        self.mark_changed(note_id)
+        if self.tag_bits is not None:
+            self.note_bits.discard(note_id)
         if self.data[note_id]['tags']:
             for tag in self.data[note_id]['tags']:
-                self.tags.get(tag).remove(note_id)
+                self.delete_from_tag(tag, note_id)
         else:
-            self.tags.get("#").remove(note_id)
+            self.delete_from_tag("#", note_id)
 
     def delete_tag(self, note_id: int, tag: str):
-        self.save_changes = True
+        self.mark_changed(note_id)
         self.data[note_id]['tags'].remove(tag)
-        if len(self.tags[tag]) == 1:
-            del self.tags[tag]
-        else:
-            self.tags[tag].remove(note_id)
+        self.delete_from_tag(tag, note_id)
         if not self.data[note_id]['tags']:
-            self.tags.setdefault("#", []).append(note_id)
+            self.add_to_tag("#", note_id)
+
+    def add_to_tag(self, tag: str, note_id: int):
+        if tag not in self.tags:
+            self.tags[tag] = set()
+            insort(self.tag_names, (tag.lower(), tag))
+            self.tag_grams.add(tag, self.tag_grams.grams(tag.lower()))
+        self.tags[tag].add(note_id)
+        if self.tag_bits is not None:
+            self.tag_bits.setdefault(tag, Bitmap()).add(note_id)
+
+    def delete_from_tag(self, tag: str, note_id: int):
+        note_ids = self.tags[tag]
+        note_ids.discard(note_id)
+        if self.tag_bits is not None:
+            self.tag_bits[tag].discard(note_id)
+        if not note_ids:
+            del self.tags[tag]
+            del self.tag_names[bisect_left(self.tag_names, (tag.lower(), tag))]
+            self.tag_grams.delete(tag, self.tag_grams.grams(tag.lower()))
+            if self.tag_bits is not None:
+                del self.tag_bits[tag]
+
+    def tag_names_scan(self):
+        # sorted (lowercase tag, tag) pairs and n-grams of lowercase tags
+        self.tag_names = sorted((tag.lower(), tag) for tag in self.tags)
+        self.tag_grams = NGramIndex()
+        for tag in self.tags:
+            self.tag_grams.add(tag, self.tag_grams.grams(tag.lower()))
+        self.tag_bits = None                          # built by first query
+
+    def tag_bits_scan(self):
+        self.tag_bits = {
+            tag: Bitmap.from_ids(ids) for tag, ids in self.tags.items()
+        }
+        self.note_bits = Bitmap.from_ids(self.data)
+
+    def add_to_words(self, note_id: int):
+        if self.words is not None:
+            self.words.add(note_id, self.data[note_id]["text"].lower())
+
+    def delete_from_words(self, note_id: int):
+        if self.words is not None:
+            self.words.delete(note_id, self.data[note_id]["text"].lower())
+
+    def add_to_fingerprints(self, note_id: int):
+        if self.fingerprints is not None:
+            self.fingerprints.add(
+                note_id, WORD.findall(self.data[note_id]["text"].lower())
+            )
+
+    def delete_from_fingerprints(self, note_id: int):
+        if self.fingerprints is not None:
+            self.fingerprints.delete(note_id)
+
+    def fingerprints_scan(self):
+        self.fingerprints = MinHashIndex()
+        for note_id in self.data:
+            self.add_to_fingerprints(note_id)
+
+    def words_scan(self):
+        self.words = TextIndex()
+        for note_id in self.data:
+            self.add_to_words(note_id)
+
+    def created_ordinal(self, note_id: int) -> int:
+        return date.fromisoformat(self.data[note_id]["created"]).toordinal()
+
+    def add_to_dates(self, note_id: int):
+        if self.dates is not None:
+            insort(self.dates, (self.created_ordinal(note_id), note_id))
+
+    def delete_from_dates(self, note_id: int):
+        if self.dates is not None:
+            del self.dates[bisect_left(
+                self.dates, (self.created_ordinal(note_id), note_id)
+            )]
+
+    def dates_scan(self):
+        # sorted (creation date ordinal, note id) pairs
+        self.dates = sorted(
+            (self.created_ordinal(note_id), note_id) for note_id in self.data
+        )
 
     def tags_scan(self):
         self.tags = {}
+        self.tag_names_scan()
         for note_id in self.data:
             self.add_id_to_tags(note_id)
 
@@ -50,35 +186,263 @@ class NoteBook():
                 "tags": v['tags']
             }
 
-    def read_from_file(self):
-        self.data: dict = {}
-        self.max_id = 0
-        self.save_changes = False
+    def to_dict(self) -> dict:
+        return {
+            k: {
+                "text": v["text"], "created": v["created"],
+                "tags": list(v["tags"])     # edited meanwhile by input thread
+            }
+            for k, v in list(self.data.items())     # see AddressBook.to_dict
+        }
+
+    def to_snapshot(self, items: list[tuple] = None) -> list[tuple]:
+        # all notes or the given (id, note) pairs, with their tag index
+        if items is None:
+            items = list(self.data.items())
+        note_ids = [note_id for note_id, _ in items]
+        notes = [note for _, note in items]
+        # one copy of the tag lists, which the input thread edits in place,
+        # so the counts, tags and index below agree
+        note_tags = [list(note["tags"]) for note in notes]
+        index = {}
+        for note_id, x in zip(note_ids, note_tags):
+            for tag in x or ["#"]:
+                index.setdefault(tag, []).append(note_id)
+        tags = list(index)
+        if self.blob_storage:                     # blob generation, positions
+            positions = [x.index for x in notes]
+            texts = [
+                (INTS, [self.blobs.generation]),
+                (INTS, [offset for offset, _ in positions]),
+                (INTS, [size for _, size in positions]),
+            ]
+        else:
+            texts = [(TEXTS, [x["text"] for x in notes])]
+        return [
+            (INTS, note_ids),
+            (INTS, [date.fromisoformat(x["created"]).toordinal()
+                    for x in notes]),
+            (INTS, [len(x) for x in note_tags]),
+            (STRINGS, [tag for x in note_tags for tag in x]),
+            *texts,
+            (STRINGS, tags),                            # prebuilt tag index
+            (INTS, [len(index[tag]) for tag in tags]),
+            (INTS, [note_id for tag in tags for note_id in index[tag]]),
+        ]
+
+    def from_snapshot(self, sections: list):
+        note_ids, created, tag_counts, note_tags, *texts, \
+            tags, tag_sizes, tag_note_ids = sections
+        if len(texts) == 1:
+            texts, positions = texts[0], range(len(note_ids))
+        else:
+            (generation,), offsets, sizes = texts
+            if self.blobs is None or self.blobs.generation != generation:
+                self.blobs = BlobStore(self.blob_path(generation), generation)
+            texts, positions = self.blobs, list(zip(offsets, sizes))
+        position = 0
+        for i, note_id in enumerate(note_ids):
+            self.data[note_id] = LazyNote(
+                texts, positions[i],
+                date.fromordinal(created[i]).isoformat(),
+                note_tags[position:position + tag_counts[i]],
+            )
+            position += tag_counts[i]
+        position = 0
+        for tag, size in zip(tags, tag_sizes):
+            self.tags.setdefault(tag, set()).update(
+                tag_note_ids[position:position + size]
+            )
+            position += size
+
+    def load_texts(self):
+        # reads all texts into memory and releases the mapped snapshot;
+        # setdefault keeps a text updated meanwhile by the input thread
+        for note in list(self.data.values()):
+            if isinstance(note, LazyNote) and note.texts is not None:
+                note.setdefault("text", note["text"])
+                note.texts = None
+
+    def blob_path(self, generation: int) -> Path:
+        return self.file_path.with_suffix(f".{generation}.blobs")
+
+    def last_blob_generation(self) -> int:
+        # the newest generation with a file, loaded or not
+        generations = (
+            path.suffixes[-2][1:] for path in self.file_path.parent.glob(
+                f"{self.file_path.stem}.*.blobs"
+            )
+        )
+        return max((int(x) for x in generations if x.isdigit()), default=0)
+
+    def move_texts_to_blobs(self):
+        # copies the live texts into a new blob file and saves the notes
+        old_blobs = self.blobs
+        generation = self.last_blob_generation() + 1
+        self.blobs = BlobStore(self.blob_path(generation), generation, True)
+        for note_id, note in self.data.items():
+            self.data[note_id] = self.new_note(
+                note["text"], note["created"], note["tags"]
+            )
+        self.mark_all_changed()
+        self.write_to_file()
+        if old_blobs:
+            old_blobs.close()
+            if not self.bad_shards:                   # may still refer to it
+                old_blobs.path.unlink(missing_ok=True)
+
+    def new_note(self, text: str, created: str, tags: list[str]) -> dict:
+        if self.blob_storage:
+            return LazyNote(self.blobs, self.blobs.append(text), created, tags)
+        return {"text": text, "created": created, "tags": tags}
+
+    def read_json(self):
         if self.file_path.exists():
             with open(self.file_path, "r", encoding="utf-8") as f:
                 try:
                     self.from_dict(json.load(f))
                 except json.decoder.JSONDecodeError:
                     print(f"ERROR: File {self.file_path} could not be decoded")
+
+    def read_source(self, path: Path) -> bool:
+        if path == self.shard_path:
+            return self.read_shards()
+        sections = read_snapshot(
+            path, b"NI" if path == self.index_path else b"NB"
+        )
+        if sections:
+            self.from_snapshot(sections)
+        return bool(sections)
+
+    def read_shards(self) -> bool:
+        # a shard that cannot be read is reported and left as it is; the
+        # others are loaded, so no older source replaces the whole set
+        paths = sorted(self.shard_path.glob("*.snapshot"))
+        with ThreadPoolExecutor() as executor:
+            shards = list(executor.map(
+                lambda path: read_snapshot(path, b"NS"), paths
+            ))
+        for path, sections in zip(paths, shards):
+            if sections is None:
+                print(f"ERROR: Shard {path} could not be read")
+                self.bad_shards.add(int(path.stem))
+            else:
+                self.from_snapshot(sections)
+        return True
+
+    def read_from_file(self):
+        self.data: dict = {}
+        self.tags = {}
+        self.dirty_shards = set()
+        self.bad_shards = set()                       # never written over
+        self.max_id = 0
+        self.words = None                             # built by first search
+        self.dates = None
+        self.fingerprints = None
+        gc.disable()                                  # no cycles to collect
+        try:
+            self.read_sources()
+        finally:
+            gc.enable()
         if self.data:
             self.max_id = max(self.data.keys()) + 1
-        self.tags_scan()
+        if self.bad_shards:                           # new ids go past them
+            self.max_id = max(
+                self.max_id, (max(self.bad_shards) + 1) * SHARD_SIZE
+            )
+
+    def read_sources(self):
+        sources = sorted(                             # the freshest first
+            (path for path in (
+                self.shard_path, self.index_path, self.snapshot_path
+            ) if is_fresh(path, self.file_path)),
+            key=lambda path: path.stat().st_mtime_ns, reverse=True
+        )
+        source = next((x for x in sources if self.read_source(x)), None)
+        failed = sources[:sources.index(source)] if source else sources
+        if self.blob_storage and self.index_path in failed:
+            # an older source would be saved over the index and blobs
+            raise ValueError(f"ERROR: '{self.index_path}' could not be read.")
+        if source is None:
+            self.read_json()
+            self.tags_scan()
+        else:
+            self.tag_names_scan()
+        self.dirty_shards = set()
+        self.save_changes = False
+        if self.sharded and source != self.shard_path:
+            self.mark_all_changed()                   # first save writes all
+        if self.blob_storage:
+            self.check_blobs()
+
+    def check_blobs(self):
+        # shards saved in another mode hold notes that are not in the
+        # current blob file; they are moved there and saved again
+        if self.blobs is None:
+            self.move_texts_to_blobs()
+            return
+        for note_id, note in list(self.data.items()):
+            if not isinstance(note, LazyNote) or note.texts is not self.blobs:
+                self.data[note_id] = self.new_note(
+                    note["text"], note["created"], note["tags"]
+                )
+                self.mark_changed(note_id)
+        if self.blobs.size > BLOB_SLACK + 2 * sum(
+            note.index[1] for note in self.data.values()
+        ):
+            self.move_texts_to_blobs()
 
     def write_to_file(self):
-        if self.save_changes:
-            with open(self.file_path, "w", encoding="utf-8") as f:
-                json.dump(self.data, f)
-                self.save_changes = False
-
-    def add_note(self, text: str, tags: list[str] = []):
-        self.data[self.max_id] = {
-            "text": text,
-            "created": datetime.today().strftime(DATE_FORMAT),
-            "tags": tags
-        }
-        self.add_id_to_tags(self.max_id, tags)
+        with self.write_lock:
+            if self.save_changes:
+                self.save_changes = False   # edits from now on are saved later
+                if self.blob_storage:       # texts are already in the blobs
+                    self.blobs.flush()
+                elif os.name == "nt":   # Windows cannot replace a mapped file
+                    self.load_texts()
+                if self.sharded:
+                    self.write_shards()
+                elif self.blob_storage:
+                    write_snapshot(self.index_path, b"NI", self.to_snapshot())
+                else:
+                    tmp_path = self.file_path.with_suffix(".tmp")
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump(self.to_dict(), f)
+                    tmp_path.replace(self.file_path)
+                    write_snapshot(
+                        self.snapshot_path, b"NB", self.to_snapshot()
+                    )
+
+    def write_shards(self):
+        self.shard_path.mkdir(exist_ok=True)
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(
+                self.write_shard, list(self.dirty_shards - self.bad_shards)
+            ))
+
+    def write_shard(self, shard: int):
+        self.dirty_shards.discard(shard)    # edits from now on are saved later
+        path = self.shard_path / f"{shard:06}.snapshot"
+        items = [
+            (note_id, note)
+            for note_id in range(shard * SHARD_SIZE, (shard + 1) * SHARD_SIZE)
+            if (note := self.data.get(note_id)) is not None
+        ]
+        if items:
+            write_snapshot(path, b"NS", self.to_snapshot(items))
+        else:
+            path.unlink(missing_ok=True)
+
+    def add_note(self, text: str, tags: list[str] = ()):
+        self.data[self.max_id] = self.new_note(
+            text, datetime.today().strftime(DATE_FORMAT), list(tags)
+        )
+        self.add_id_to_tags(self.max_id)
+        self.add_to_words(self.max_id)
+        self.add_to_dates(self.max_id)
+        self.add_to_fingerprints(self.max_id)
+        self.mark_changed(self.max_id)
         self.max_id += 1
-        self.save_changes = True
 
     def add_tag(self, note_id: int, tag: str):
         if search(r"^#\w+$", tag):
@@ -86,39 +450,189 @@ class NoteBook():
                 if tag in self.data[note_id]['tags']:
                     raise KeyError(f"Cannot duplicate tag '{tag}'")
             else:
-                self.tags["#"].remove(note_id)
-            self.save_changes = True
+                self.delete_from_tag("#", note_id)
+            self.mark_changed(note_id)
             self.data[note_id]['tags'].append(tag)
-            self.tags.setdefault(tag, []).append(note_id)
+            self.add_to_tag(tag, note_id)
         else:
             raise ValueError(f"'{tag}' is not a valid hashtag")
 
     def delete_note(self, note_id: int):
         self.delete_id_from_tags(note_id)
+        self.delete_from_words(note_id)
+        self.delete_from_dates(note_id)
+        self.delete_from_fingerprints(note_id)
         del self.data[note_id]
-        self.save_changes = True
+        self.mark_changed(note_id)
 
     def update_text(self, note_id: int, text: str):
-        self.data[note_id]["text"] = text
-        self.save_changes = True
+        self.delete_from_words(note_id)
+        if self.blob_storage:
+            note = self.data[note_id]
+            self.data[note_id] = self.new_note(
+                text, note["created"], note["tags"]
+            )
+        else:
+            self.data[note_id]["text"] = text
+        self.add_to_words(note_id)
+        self.delete_from_fingerprints(note_id)
+        self.add_to_fingerprints(note_id)
+        self.mark_changed(note_id)
+
+    def iter_search_text(self, search_str: str = None):
+        # unsorted matches
+        if not search_str:
+            yield from self.data
+            return
+        search_str = search_str.lower()
+        if self.words is None:
+            self.words_scan()
+        note_ids = self.words.candidates(search_str)
+        if note_ids is None:                          # no word to look up
+            note_ids = self.data.keys()
+        elif WORD.fullmatch(search_str):              # found inside a word
+            yield from note_ids
+            return
+        for note_id in note_ids:
+            if search_str in self.data[note_id]["text"].lower():
+                yield note_id
 
     def search_text(self, search_str: str = None) -> list[int]:
+        return self.cache.get(
+            ("search_text", search_str),
+            lambda: sorted(self.iter_search_text(search_str))
+        )
+
+    def search_text_page(self, search_str: str = None, limit: int = 20,
+                         after: int = None) -> list[int]:
+        # first `limit` sorted matches after the `after` cursor
+        return self.cache.get(
+            ("search_text_page", search_str, limit, after),
+            lambda: self.text_page(search_str, limit, after)
+        )
+
+    def text_page(self, search_str: str, limit: int, after: int) -> list[int]:
+        note_ids = self.iter_search_text(search_str)
+        if after is not None:
+            note_ids = (note_id for note_id in note_ids if note_id > after)
+        return nsmallest(limit, note_ids)
+
+    def search_ranked(self, search_str: str, limit: int = 20) -> list[int]:
+        # best matching notes first
+        return self.cache.get(
+            ("search_ranked", search_str, limit),
+            lambda: self.ranked_notes(search_str, limit)
+        )
+
+    def ranked_notes(self, search_str: str, limit: int) -> list[int]:
+        if self.words is None:
+            self.words_scan()
+        return [
+            note_id
+            for _, note_id in self.words.rank(search_str.lower(), limit)
+        ]
+
+    def search_created(self, start: date = None, end: date = None,
+                       search_str: str = None, tag: str = None) -> list[int]:
+        # notes created from start to end (both included), optionally
+        # matching a text pattern and a tag pattern or tag query
+        return self.cache.get(
+            ("search_created", start, end, search_str, tag),
+            lambda: self.created_notes(start, end, search_str, tag)
+        )
+
+    def created_notes(self, start: date, end: date, search_str: str,
+                      tag: str) -> list[int]:
+        if self.dates is None:
+            self.dates_scan()
+        lower = bisect_left(self.dates, (start.toordinal(),)) if start else 0
+        upper = bisect_left(self.dates, (end.toordinal() + 1,)) if end \
+            else len(self.dates)
+        note_ids = [note_id for _, note_id in self.dates[lower:upper]]
         if search_str:
-            return sorted(
-                note_id for note_id, note in self.data.items()
-                if search_str.lower() in note['text'].lower()
+            matches = set(self.search_text(search_str))
+            note_ids = [x for x in note_ids if x in matches]
+        if tag:
+            matches = set(
+                self.search_tag_query(tag) if is_tag_query(tag)
+                else self.search_tag(tag) or ()
             )
-        else:
-            return sorted(self.data.keys())
+            note_ids = [x for x in note_ids if x in matches]
+        return sorted(note_ids)
+
+    def search_duplicates(self, note_id: int) -> list[int]:
+        # near-duplicates of a note, the closest first
+        return self.cache.get(
+            ("search_duplicates", note_id),
+            lambda: [x for _, x in self.duplicates_index().search(note_id)]
+        )
+
+    def duplicate_clusters(self) -> list[list[int]]:
+        # groups of notes linked by near-duplicate pairs
+        return self.cache.get(
+            ("duplicate_clusters",),
+            lambda: self.duplicates_index().clusters()
+        )
+
+    def duplicates_index(self) -> MinHashIndex:
+        if self.fingerprints is None:
+            self.fingerprints_scan()
+        return self.fingerprints
+
+    def merge_notes(self, note_id: int, note_ids: list[int]):
+        # adds the tags of the other notes to a note and deletes them
+        for other_id in note_ids:
+            if other_id == note_id:
+                continue
+            for tag in self.data[other_id]["tags"]:
+                if tag not in self.data[note_id]["tags"]:
+                    self.add_tag(note_id, tag)
+            self.delete_note(other_id)
 
     def search_tag(self, search_str: str):
+        return self.cache.get(
+            ("search_tag", search_str), lambda: self.tag_notes(search_str)
+        )
+
+    def tag_notes(self, search_str: str):
         if search_str in ("", "#"):
-            return self.tags.get("#")
-        result_set = set()
-        for tag, note_id_list in self.tags.items():
-            if search_str.lower() in tag.lower():
-                result_set.update(note_id_list)
-        return sorted(result_set)
+            return sorted(self.tags["#"]) if "#" in self.tags else None
+        search_str = search_str.lower()
+        if search_str.startswith("#"):      # '#' is only the first character
+            tags = []
+            position = bisect_left(self.tag_names, (search_str,))
+            for name, tag in islice(self.tag_names, position, None):
+                if not name.startswith(search_str):
+                    break
+                tags.append(tag)
+        else:
+            tags = self.tag_grams.candidates(search_str)
+            if tags is None:                          # shorter than n-gram
+                tags = self.tags
+            tags = [tag for tag in tags if search_str in tag.lower()]
+        return sorted(set().union(*(self.tags[tag] for tag in tags)))
+
+    def search_tag_query(self, query: str) -> list[int]:
+        # boolean query of whole tags, e.g. "#work AND NOT (#done OR #old)"
+        return self.cache.get(
+            ("search_tag_query", query), lambda: self.query_notes(query)
+        )
+
+    def query_notes(self, query: str) -> list[int]:
+        node = TagQuery(query).parse()
+        if self.tag_bits is None:
+            self.tag_bits_scan()
+        return evaluate(node, self.query_bits, self.note_bits).ids()
+
+    def query_bits(self, name: str) -> Bitmap:
+        # tags are matched ignoring case
+        bits, name = Bitmap(), name.lower()
+        position = bisect_left(self.tag_names, (name,))
+        for lower, tag in islice(self.tag_names, position, None):
+            if lower != name:
+                break
+            bits |= self.tag_bits[tag]
+        return bits
 
     def __len__(self):
         return len(self.data)
@@ -0,0 +1,144 @@
+import mmap
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+MAGIC = b"HW2S"
+VERSION = 1
+HEADER = struct.Struct("<4sHc2sI")  # magic, version, byte order, kind, count
+SECTION = struct.Struct("<cQ")      # section type, payload size
+INTS, STRINGS, TEXTS = b"i", b"s", b"t"
+BYTE_ORDER = sys.byteorder[0].encode()
+
+
+class Texts:
+    # strings decoded from the mapped file on every access
+    def __init__(self, buffer: mmap.mmap, offsets: array, start: int):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.start = start
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.buffer[
+            self.start + self.offsets[i]:self.start + self.offsets[i + 1]
+        ], "utf-8")
+
+
+class BlobStore:
+    # append-only file of utf-8 texts read through mmap by (offset, size)
+    def __init__(self, path: Path, generation: int, create=False):
+        self.path = path
+        self.generation = generation
+        self.file = open(path, "x+b" if create else "a+b")   # no truncating
+        self.size = self.file.seek(0, 2)
+        self.buffer = None
+        self.mapped = 0
+
+    def append(self, text: str) -> tuple[int, int]:
+        blob = text.encode()
+        offset = self.size
+        self.file.write(blob)
+        self.size += len(blob)
+        return offset, len(blob)
+
+    def flush(self):
+        self.file.flush()
+
+    def remap(self):
+        self.flush()
+        if self.buffer is not None:
+            self.buffer.close()
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mapped = self.size
+
+    def __getitem__(self, index: tuple[int, int]) -> str:
+        offset, size = index
+        if not size:
+            return ""
+        if offset + size > self.mapped:
+            self.remap()
+        return str(self.buffer[offset:offset + size], "utf-8")
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+        self.file.close()
+
+
+def encode_section(kind: bytes, values) -> bytes:
+    if kind == INTS:
+        return array("q", values).tobytes()
+    if kind == STRINGS:         # count, lengths (in characters), text
+        lengths = array("q", [len(values)] + [len(x) for x in values])
+        return lengths.tobytes() + "".join(values).encode()
+    blobs = [x.encode() for x in values]    # TEXTS: count, offsets, bytes
+    offsets = array("q", [len(blobs), 0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return offsets.tobytes() + b"".join(blobs)
+
+
+def write_snapshot(path: Path, kind: bytes, sections: list[tuple]):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, BYTE_ORDER, kind, len(sections)))
+        for section_type, values in sections:
+            payload = encode_section(section_type, values)
+            f.write(SECTION.pack(section_type, len(payload)))
+            f.write(payload)
+    tmp_path.replace(path)
+
+
+def decode_section(buffer: mmap.mmap, section_type: bytes, start: int,
+                   size: int):
+    if section_type == INTS:
+        return array("q", buffer[start:start + size])
+    count = array("q", buffer[start:start + 8])[0]
+    if section_type == TEXTS:
+        offsets = array("q", buffer[start + 8:start + 8 * (count + 2)])
+        return Texts(buffer, offsets, start + 8 * (count + 2))
+    lengths = array("q", buffer[start + 8:start + 8 * (count + 1)])
+    text = str(buffer[start + 8 * (count + 1):start + size], "utf-8")
+    strings, position = [], 0
+    for length in lengths:
+        strings.append(text[position:position + length])
+        position += length
+    return strings
+
+
+def read_snapshot(path: Path, kind: bytes) -> list:
+    # decoded sections or None if the file is missing or not compatible
+    if not path.exists() or not path.stat().st_size:
+        return None
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, byte_order, file_kind, count = \
+            HEADER.unpack_from(buffer)
+        if (magic, version, byte_order, file_kind) != \
+                (MAGIC, VERSION, BYTE_ORDER, kind):
+            raise ValueError("incompatible snapshot")
+        sections, position = [], HEADER.size
+        for _ in range(count):
+            section_type, size = SECTION.unpack_from(buffer, position)
+            position += SECTION.size
+            sections.append(
+                decode_section(buffer, section_type, position, size)
+            )
+            position += size
+    except (struct.error, ValueError):
+        buffer.close()
+        return None
+    return sections
+
+
+def is_fresh(snapshot_path: Path, source_path: Path) -> bool:
+    # the snapshot is not older than the JSON file it was written with
+    return snapshot_path.exists() and (
+        not source_path.exists()
+        or snapshot_path.stat().st_mtime_ns >= source_path.stat().st_mtime_ns
+    )
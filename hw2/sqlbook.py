@@ -0,0 +1,241 @@
+import sqlite3
+from collections.abc import Mapping
+from pathlib import Path
+from datetime import datetime
+from addrbook import AddressBook, Record, Phone, Birthday, Email, \
+    birthday_ranges
+from indexes import BKTree
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    name TEXT PRIMARY KEY,
+    birthday TEXT,
+    email TEXT,
+    month INTEGER,
+    day INTEGER
+);
+CREATE INDEX IF NOT EXISTS records_birthday ON records (month, day);
+CREATE TABLE IF NOT EXISTS phones (
+    name TEXT NOT NULL REFERENCES records (name) ON DELETE CASCADE,
+    phone TEXT NOT NULL,
+    UNIQUE (name, phone)
+);
+CREATE INDEX IF NOT EXISTS phones_phone ON phones (phone);
+"""
+
+
+class SQLAddressBook(Mapping):
+    # the AddressBook API on sqlite3; only Record and birthday_ranges are
+    # shared with the in-memory book
+    def __init__(self, filename="ab.db", source="ab.json"):
+        self.file_path = Path(filename)
+        self.connection = sqlite3.connect(self.file_path)
+        self.connection.create_function(
+            "py_lower", 1, str.lower, deterministic=True
+        )
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        self.save_changes = False
+        self.journal = False
+        self.fuzzy = None                             # built by first search
+        if not len(self) and Path(source).exists():
+            self.migrate(AddressBook(source))
+
+    def migrate(self, source: AddressBook):
+        with self.connection:
+            for record in source.values():
+                self.insert_record(record)
+        print(f"{len(source)} contacts imported from '{source.file_path}'")
+
+    def insert_record(self, record: Record):
+        birthday = record.birthday
+        self.connection.execute(
+            "INSERT INTO records VALUES (?, ?, ?, ?, ?)", (
+                record.name.value,
+                birthday.to_date_str() if birthday else None,
+                record.email.value if record.email else None,
+                *(birthday.month_day() if birthday else (None, None)),
+            )
+        )
+        self.connection.executemany(
+            "INSERT INTO phones VALUES (?, ?)",
+            ((record.name.value, p.value) for p in record.phone)
+        )
+        if self.fuzzy is not None:
+            self.fuzzy.add(record.name.value, record.name.value.lower())
+
+    def add_record(self, record: Record):
+        if record.name.value in self:
+            raise KeyError(f"Cannot duplicate '{record.name.value}'")
+        with self.connection:
+            self.insert_record(record)
+
+    def delete_record(self, name: str) -> bool:
+        with self.connection:
+            deleted = bool(self.connection.execute(
+                "DELETE FROM records WHERE name = ?", (name,)
+            ).rowcount)
+        if deleted and self.fuzzy is not None:
+            self.fuzzy.delete(name, name.lower())
+        return deleted
+
+    def add_phone(self, name: str, phone: Phone) -> bool:
+        if name not in self:
+            raise KeyError(name)
+        phones = phone if isinstance(phone, (list, tuple)) else [phone]
+        with self.connection:
+            counter = 0
+            for p in phones:
+                counter += self.connection.execute(
+                    "INSERT OR IGNORE INTO phones VALUES (?, ?)",
+                    (name, p.value)
+                ).rowcount
+        if counter:
+            return True
+
+    def delete_phone(self, name: str, phone: Phone):
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM phones WHERE name = ? AND phone = ?",
+                (name, phone.value)
+            )
+
+    def set_columns(self, name: str, columns: str, values: tuple) -> int:
+        return self.connection.execute(
+            f"UPDATE records SET {columns} WHERE name = ?", (*values, name)
+        ).rowcount
+
+    def set_birthday(self, name: str, birthday: Birthday) -> int:
+        return self.set_columns(
+            name, "birthday = ?, month = ?, day = ?",
+            (birthday.to_date_str(), *birthday.month_day()) if birthday
+            else (None, None, None)
+        )
+
+    def set_email(self, name: str, email: Email) -> int:
+        return self.set_columns(
+            name, "email = ?", (email.value if email else None,)
+        )
+
+    def update_birthday(self, name: str, birthday: Birthday):
+        with self.connection:
+            if not self.set_birthday(name, birthday):
+                raise KeyError(name)
+
+    def update_email(self, name: str, email: Email):
+        with self.connection:
+            if not self.set_email(name, email):
+                raise KeyError(name)
+
+    def merge(self, records):
+        # bulk update in one transaction
+        with self.connection:
+            for record in records:
+                name = record.name.value
+                row = self.connection.execute(
+                    "SELECT birthday, email FROM records WHERE name = ?",
+                    (name,)
+                ).fetchone()
+                if row is None:
+                    self.insert_record(record)
+                    continue
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO phones VALUES (?, ?)",
+                    ((name, p.value) for p in record.phone)
+                )
+                if record.birthday and not row[0]:
+                    self.set_birthday(name, record.birthday)
+                if record.email and not row[1]:
+                    self.set_email(name, record.email)
+
+    def search_birthday(self, days: int) -> list[str]:
+        ranges = birthday_ranges(datetime.today(), days)
+        return [name for name, in self.connection.execute(
+            "SELECT name FROM records WHERE "
+            + " OR ".join(["(month, day) BETWEEN (?, ?) AND (?, ?)"]
+                          * len(ranges))
+            + " ORDER BY name",
+            [x for lower, upper in ranges for x in (*lower, *upper)]
+        )]
+
+    def search_fuzzy(self, search_str: str, max_distance=1) -> list[str]:
+        # names within the edit distance, closest first
+        if self.fuzzy is None:
+            self.fuzzy = BKTree()
+            for name in self:
+                self.fuzzy.add(name, name.lower())
+        matches = self.fuzzy.search(search_str.lower(), max_distance)
+        return [name for _, name in matches]
+
+    def search_phone(self, phone: str) -> list[str]:
+        return [name for name, in self.connection.execute(
+            "SELECT name FROM phones WHERE phone = ? ORDER BY name", (phone,)
+        )]
+
+    def search_query(self, search_str=None) -> tuple[str, list]:
+        query, params = "SELECT name FROM records", []
+        if search_str:
+            query += " WHERE instr(py_lower(name), ?)"
+            params.append(search_str.lower())
+            if search_str.isdigit():
+                query += " UNION SELECT name FROM phones WHERE instr(phone, ?)"
+                params.append(search_str)
+        return query, params
+
+    def iter_search(self, search_str=None):
+        # unsorted matches
+        query, params = self.search_query(search_str)
+        for name, in self.connection.execute(query, params).fetchall():
+            yield name
+
+    def search(self, search_str=None) -> list[str]:
+        query, params = self.search_query(search_str)
+        return [name for name, in self.connection.execute(
+            query + " ORDER BY name", params
+        )]
+
+    def search_page(self, search_str=None, limit=20, after=None) -> list[str]:
+        query, params = self.search_query(search_str)
+        return [name for name, in self.connection.execute(
+            f"SELECT name FROM ({query}) WHERE name > ? ORDER BY name LIMIT ?",
+            (*params, "" if after is None else after, limit)
+        )]
+
+    def __getitem__(self, name: str) -> Record:
+        row = self.connection.execute(
+            "SELECT name, birthday, email FROM records WHERE name = ?",
+            (name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return Record.from_dict({
+            "name": row[0],
+            "birthday": row[1],
+            "email": row[2],
+            "phone": [phone for phone, in self.connection.execute(
+                "SELECT phone FROM phones WHERE name = ? ORDER BY rowid",
+                (name,)
+            )],
+        })
+
+    def __contains__(self, name: str) -> bool:
+        return self.connection.execute(
+            "SELECT 1 FROM records WHERE name = ?", (name,)
+        ).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "SELECT count(*) FROM records"
+        ).fetchone()[0]
+
+    def __iter__(self):
+        for name, in self.connection.execute(
+            "SELECT name FROM records ORDER BY name"
+        ):
+            yield name
+
+    def to_dict(self) -> dict:
+        return {name: self[name].to_dict() for name in self}
+
+    def write_to_file(self):
+        self.connection.commit()
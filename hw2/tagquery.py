@@ -0,0 +1,183 @@
+from array import array
+from re import compile, finditer
+
+TOKEN = compile(r"[()]|[^\s()]+")
+CHUNK_BITS = 12             # 4096 ids per bitmap chunk
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+SPARSE_LIMIT = 64           # ids of a chunk kept as offsets, not bits
+
+
+class TagQuery:
+    # NOT binds tighter than AND, AND tighter than OR, and terms written
+    # side by side are joined with AND: "#work #urgent NOT #done"
+    def __init__(self, query: str):
+        self.tokens = TOKEN.findall(query)
+        self.position = 0
+
+    def parse(self) -> tuple:
+        # ("tag", tag), ("not", node), ("and", node, node), ("or", node, node)
+        if not self.tokens:
+            raise ValueError("Empty tag query")
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected '{self.tokens[self.position]}'")
+        return node
+
+    def peek(self) -> str:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position].upper()
+
+    def take(self) -> str:
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def parse_or(self) -> tuple:
+        node = self.parse_and()
+        while self.peek() == "OR":
+            self.take()
+            node = ("or", node, self.parse_and())
+        return node
+
+    def parse_and(self) -> tuple:
+        node = self.parse_not()
+        while self.peek() not in (None, "OR", ")"):
+            if self.peek() == "AND":
+                self.take()
+            node = ("and", node, self.parse_not())
+        return node
+
+    def parse_not(self) -> tuple:
+        operator = self.peek()
+        if operator is None:
+            raise ValueError("Incomplete tag query")
+        token = self.take()
+        if operator == "NOT":
+            return ("not", self.parse_not())
+        if operator == "(":
+            node = self.parse_or()
+            if self.peek() != ")":
+                raise ValueError("Missing ')' in tag query")
+            self.take()
+            return node
+        if operator in ("AND", "OR", ")"):
+            raise ValueError(f"Unexpected '{token}'")
+        if not token.startswith("#"):
+            raise ValueError(f"'{token}' is not a hashtag")
+        return ("tag", token)
+
+
+def is_tag_query(text: str) -> bool:
+    # several terms or parentheses, not a single tag pattern
+    return len(TOKEN.findall(text)) > 1
+
+
+def pack(bits: int):
+    # a chunk with few ids is kept as their offsets, the others as bits
+    if bits.bit_count() > SPARSE_LIMIT:
+        return bits
+    return array("H", (
+        match.start() for match in finditer("1", bin(bits)[:1:-1])
+    ))
+
+
+def unpack(chunk) -> int:
+    if isinstance(chunk, int):
+        return chunk
+    return sum(1 << offset for offset in chunk)
+
+
+class Bitmap(dict):
+    # chunk number -> the ids in that chunk as an int bitset, or as an
+    # array of offsets for a sparse chunk; empty chunks are dropped, so
+    # an update costs at most a chunk and a sparse tag a few bytes per id
+    # (the operators do not pack the chunks of their temporary results)
+    @classmethod
+    def from_ids(cls, ids) -> "Bitmap":
+        chunks = {}
+        for i in ids:
+            if (chunk := chunks.get(i >> CHUNK_BITS)) is None:
+                chunk = chunks[i >> CHUNK_BITS] = bytearray(CHUNK_SIZE // 8)
+            chunk[(i & CHUNK_MASK) >> 3] |= 1 << (i & 7)
+        return cls(
+            (key, pack(int.from_bytes(chunk, "little")))
+            for key, chunk in chunks.items()
+        )
+
+    def set_chunk(self, key: int, bits: int, packed=True):
+        if bits:
+            self[key] = pack(bits) if packed else bits
+        else:
+            self.pop(key, None)
+
+    def add(self, i: int):
+        key = i >> CHUNK_BITS
+        self.set_chunk(
+            key, unpack(self.get(key, 0)) | 1 << (i & CHUNK_MASK)
+        )
+
+    def discard(self, i: int):
+        key = i >> CHUNK_BITS
+        self.set_chunk(
+            key, unpack(self.get(key, 0)) & ~(1 << (i & CHUNK_MASK))
+        )
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        if len(other) < len(self):
+            self, other = other, self
+        result = Bitmap()
+        for key, chunk in self.items():
+            if key in other:
+                result.set_chunk(
+                    key, unpack(chunk) & unpack(other[key]), False
+                )
+        return result
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        result = Bitmap(self)
+        for key, chunk in other.items():
+            if key in result:
+                result.set_chunk(
+                    key, unpack(result[key]) | unpack(chunk), False
+                )
+            else:
+                result[key] = chunk
+        return result
+
+    __ior__ = __or__                # not dict.update
+
+    def __sub__(self, other: "Bitmap") -> "Bitmap":
+        result = Bitmap()
+        for key, chunk in self.items():
+            if key in other:
+                result.set_chunk(
+                    key, unpack(chunk) & ~unpack(other[key]), False
+                )
+            else:
+                result[key] = chunk
+        return result
+
+    def ids(self) -> list[int]:
+        # sorted ids
+        result = []
+        for key in sorted(self):
+            chunk, base = self[key], key << CHUNK_BITS
+            if isinstance(chunk, int):
+                result.extend(
+                    base | match.start()
+                    for match in finditer("1", bin(chunk)[:1:-1])
+                )
+            else:
+                result.extend(base | offset for offset in chunk)
+        return result
+
+
+def evaluate(node: tuple, lookup, universe: Bitmap) -> Bitmap:
+    # lookup(tag) gives the bitmap of a tag, universe the bitmap of all ids
+    if node[0] == "tag":
+        return lookup(node[1])
+    if node[0] == "not":
+        return universe - evaluate(node[1], lookup, universe)
+    left = evaluate(node[1], lookup, universe)
+    right = evaluate(node[2], lookup, universe)
+    return left & right if node[0] == "and" else left | right